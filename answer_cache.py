@@ -0,0 +1,342 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+_PUNCTUATION = re.compile(r'[^\w\s]+')
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_question(text):
+    """Lowercase, drop punctuation (including ؟ and ،) and collapse whitespace."""
+    return _WHITESPACE.sub(' ', _PUNCTUATION.sub(' ', text.lower())).strip()
+
+
+class _Flight:
+    """A question being answered; identical questions wait on ``done``."""
+
+    def __init__(self, key, question):
+        self.key = key
+        self.question = question
+        self.vector = None
+        self.done = threading.Event()
+        self.answer = None
+
+
+class SemanticAnswerCache:
+    """Chatbot answers reused for questions that mean the same thing.
+
+    Each answer is stored with the embedding of its question and the
+    knowledge base version it was generated from. A question is served from
+    the cache when its normalized text matches a cached one, or else when the
+    cosine similarity of its embedding to a cached question reaches
+    ``threshold``. use_version() names the current version and drops the
+    entries of any other; lookups and stores for other versions are ignored,
+    so a request still running on an older version cannot wipe the entries of
+    the current one. Until it is called the first version seen is current.
+    Entries expire after ``ttl`` seconds and the least
+    recently used are evicted beyond ``max_size``.
+
+    Concurrent misses for the same normalized question share one computation;
+    get_or_compute() does this for a function, claim()/finish() for callers
+    that produce the answer themselves, such as a stream. A caller waits at
+    most ``wait_timeout`` seconds for the shared answer before computing its own.
+    The cache is written to ``path`` (numpy .npz) by save(), which the thread
+    started by start_saver() calls every ``save_interval`` seconds, and read
+    back by load().
+    """
+
+    def __init__(self, embed, path=None, max_size=2000, ttl=86400, threshold=0.92, save_interval=60,
+                 wait_timeout=None):
+        self.embed = embed
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.save_interval = save_interval
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        # id -> {'question', 'normalized', 'answer', 'vector', 'created'}
+        self._entries = OrderedDict()
+        self._by_text = {}
+        self._matrix = None
+        self._version = None
+        self._next_id = 0
+        self._flights = {}
+        self._dirty = False
+        self._saver = None
+        self._stop = threading.Event()
+        self._stats = {
+            'exact_hits': 0,
+            'semantic_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'wait_timeouts': 0,
+            'evictions': 0,
+            'expirations': 0,
+        }
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        if self._by_text.get(entry['normalized']) == entry_id:
+            del self._by_text[entry['normalized']]
+        self._matrix = None
+
+    def _switch(self, version):
+        # Answers from another knowledge base version may cite stale content
+        self._entries.clear()
+        self._by_text.clear()
+        self._matrix = None
+        self._version = version
+        self._dirty = True
+
+    def _current(self, version):
+        if self._version is None:
+            self._switch(version)
+        return version == self._version
+
+    def use_version(self, version):
+        """Make ``version`` the current knowledge base version."""
+        with self._lock:
+            if version != self._version:
+                self._switch(version)
+
+    def _alive(self, entry_id, now):
+        if self._entries[entry_id]['created'] + self.ttl > now:
+            return True
+        self._remove(entry_id)
+        self._stats['expirations'] += 1
+        return False
+
+    def _hit(self, entry_id, kind):
+        self._entries.move_to_end(entry_id)
+        self._stats[kind] += 1
+        return self._entries[entry_id]['answer']
+
+    def _lookup_text(self, normalized, version):
+        with self._lock:
+            if not self._current(version):
+                return None
+            entry_id = self._by_text.get(normalized)
+            if entry_id is not None and self._alive(entry_id, time.time()):
+                return self._hit(entry_id, 'exact_hits')
+        return None
+
+    def _lookup_vector(self, vector, version):
+        with self._lock:
+            if not self._current(version) or not self._entries:
+                return None
+            if self._matrix is None:
+                ids = list(self._entries)
+                self._matrix = (ids, np.vstack([self._entries[entry_id]['vector'] for entry_id in ids]))
+            ids, matrix = self._matrix
+            scores = matrix @ vector
+            now = time.time()
+            for index in np.argsort(-scores):
+                if scores[index] < self.threshold:
+                    break
+                if ids[index] in self._entries and self._alive(ids[index], now):
+                    return self._hit(ids[index], 'semantic_hits')
+        return None
+
+    def _put(self, question, normalized, vector, answer, version):
+        with self._lock:
+            if not self._current(version):
+                return
+            existing = self._by_text.get(normalized)
+            if existing is not None:
+                self._remove(existing)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                'question': question,
+                'normalized': normalized,
+                'answer': answer,
+                'vector': vector,
+                'created': time.time()
+            }
+            self._by_text[normalized] = entry_id
+            self._matrix = None
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+            self._dirty = True
+
+    def _vector(self, question):
+        vector = np.asarray(self.embed(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def claim(self, question, version):
+        """Look ``question`` up; returns (answer, source, flight).
+
+        On a hit ``answer`` is set and source is 'exact', 'semantic' or
+        'shared' (an identical question in flight was waited for). On a miss
+        answer is None and the caller computes the answer, then passes the
+        returned flight to finish(). The flight is None when the caller
+        should compute without caching, after the question it waited for failed
+        or did not finish within ``wait_timeout``.
+        """
+        normalized = normalize_question(question)
+        answer = self._lookup_text(normalized, version)
+        if answer is not None:
+            return answer, 'exact', None
+
+        key = (version, normalized)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(key, question)
+        if not leader:
+            # A leader whose stream was abandoned may never call finish()
+            finished = flight.done.wait(self.wait_timeout)
+            with self._lock:
+                if not finished:
+                    self._stats['wait_timeouts'] += 1
+                # Only a shared answer counts as a hit; otherwise the caller computes
+                self._stats['coalesced' if finished and flight.answer is not None else 'misses'] += 1
+            if finished and flight.answer is not None:
+                return flight.answer, 'shared', None
+            return None, None, None
+
+        try:
+            flight.vector = self._vector(question)
+            answer = self._lookup_vector(flight.vector, version)
+        except Exception:
+            self.finish(flight, None, False)
+            raise
+        if answer is not None:
+            self.finish(flight, answer, False)
+            return answer, 'semantic', None
+        with self._lock:
+            self._stats['misses'] += 1
+        return None, None, flight
+
+    def finish(self, flight, answer, cacheable):
+        """Complete a claimed question. Waiting callers get ``answer``, or compute
+        their own when it is None; it is stored only when ``cacheable``."""
+        try:
+            if cacheable and answer is not None:
+                version, normalized = flight.key
+                self._put(flight.question, normalized, flight.vector, answer, version)
+        finally:
+            flight.answer = answer
+            flight.done.set()
+            with self._lock:
+                self._flights.pop(flight.key, None)
+
+    def get_or_compute(self, question, version, compute):
+        """Cached answer for ``question`` or the result of ``compute()``.
+
+        ``compute`` returns (answer, cacheable); answers that are not
+        cacheable (errors, fallbacks) are returned but not stored. Returns
+        (answer, source) with source 'exact', 'semantic', 'shared' or 'computed'.
+        """
+        answer, source, flight = self.claim(question, version)
+        if answer is not None:
+            return answer, source
+        answer, cacheable = None, False
+        try:
+            answer, cacheable = compute()
+        finally:
+            if flight is not None:
+                self.finish(flight, answer, cacheable)
+        return answer, 'computed'
+
+    def save(self):
+        """Write the cache to ``path`` if it changed since the last save."""
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                entries = list(self._entries.values())
+                version = self._version
+                self._dirty = False
+            meta = {
+                'version': version,
+                'entries': [{key: entry[key] for key in ('question', 'normalized', 'answer', 'created')} for entry in entries]
+            }
+            vectors = np.vstack([entry['vector'] for entry in entries]) if entries else np.zeros((0, 0), dtype=np.float32)
+            temporary = self.path + '.tmp.npz'
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                np.savez(temporary, vectors=vectors, meta=np.array(json.dumps(meta)))
+                os.replace(temporary, self.path)
+            except OSError as e:
+                print(f"Could not save the answer cache: {e}")
+
+    def start_saver(self):
+        """Save every ``save_interval`` seconds on a background thread, off the
+        request path; stop_saver() ends it."""
+        if not self.path or not self.save_interval or self._saver is not None:
+            return
+        def run():
+            while not self._stop.wait(self.save_interval):
+                try:
+                    self.save()
+                except Exception as e:
+                    print(f"Could not save the answer cache: {e}")
+        self._stop.clear()
+        self._saver = threading.Thread(target=run, name='answer-cache-saver', daemon=True)
+        self._saver.start()
+
+    def stop_saver(self):
+        self._stop.set()
+        if self._saver is not None:
+            self._saver.join()
+            self._saver = None
+
+    def load(self):
+        """Read entries saved by save(); expired ones are skipped."""
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        try:
+            with np.load(self.path, allow_pickle=False) as saved:
+                vectors = saved['vectors']
+                meta = json.loads(str(saved['meta']))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not load the answer cache: {e}")
+            return 0
+        now = time.time()
+        with self._lock:
+            if not self._current(meta['version']):
+                return 0
+            for entry, vector in zip(meta['entries'], vectors):
+                if entry['created'] + self.ttl <= now:
+                    continue
+                self._entries[self._next_id] = dict(entry, vector=vector)
+                self._by_text[entry['normalized']] = self._next_id
+                self._next_id += 1
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+            self._matrix = None
+            self._dirty = False
+            return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_text.clear()
+            self._matrix = None
+            self._dirty = True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['in_flight'] = len(self._flights)
+            stats['version'] = self._version
+        stats['max_size'] = self.max_size
+        stats['ttl'] = self.ttl
+        stats['threshold'] = self.threshold
+        hits = stats['exact_hits'] + stats['semantic_hits'] + stats['coalesced']
+        lookups = hits + stats['misses']
+        stats['hit_rate'] = hits / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,261 @@
+import sqlite3
+import threading
+from datetime import date, datetime
+from urllib.parse import quote
+
+from pool import ConnectionPool
+
+try:
+    import pyodbc
+except ImportError:
+    pyodbc = None
+
+
+def _adapt(value):
+    # Store datetimes the way CURRENT_TIMESTAMP does so text comparisons stay ordered.
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+def _adapt_params(params):
+    if isinstance(params, dict):
+        return {key: _adapt(value) for key, value in params.items()}
+    return [_adapt(value) for value in params]
+
+def _convert_timestamp(value):
+    return datetime.fromisoformat(value.decode())
+
+def _convert_date(value):
+    return date.fromisoformat(value.decode()[:10])
+
+def _register_converters():
+    # sqlite3 keeps converters in one registry, but only connections opened with
+    # detect_types (SqliteBackend's) consult it.
+    sqlite3.register_converter('TIMESTAMP', _convert_timestamp)
+    sqlite3.register_converter('DATETIME', _convert_timestamp)
+    sqlite3.register_converter('DATE', _convert_date)
+
+
+class _SqliteCursor(sqlite3.Cursor):
+    """Adapts datetime parameters itself instead of through sqlite3's
+    process-wide adapter registry."""
+
+    def execute(self, sql, parameters=()):
+        return super().execute(sql, _adapt_params(parameters))
+
+    def executemany(self, sql, seq_of_parameters):
+        return super().executemany(sql, (_adapt_params(parameters) for parameters in seq_of_parameters))
+
+
+class _SqliteConnection(sqlite3.Connection):
+    def cursor(self, factory=_SqliteCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class SqlServerBackend:
+    """SQL Server over pyodbc, with connections served from a ConnectionPool."""
+
+    name = 'mssql'
+    limit_clause = 'OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY'
+    # Bound as (offset, count)
+    page_clause = 'OFFSET ? ROWS FETCH NEXT ? ROWS ONLY'
+    current_date = 'CAST(GETDATE() AS DATE)'
+
+    def __init__(self, connection_string, **pool_options):
+        if pyodbc is None:
+            raise RuntimeError("pyodbc is required for the SQL Server backend")
+        self.connection_string = connection_string
+        self.Error = pyodbc.Error
+        self.IntegrityError = pyodbc.IntegrityError
+        self.pool = ConnectionPool(self._connect, **pool_options)
+        self.pool.fill()
+
+    def _connect(self):
+        conn = pyodbc.connect(self.connection_string)
+        conn.autocommit = False
+        return conn
+
+    def acquire(self):
+        return self.pool.acquire()
+
+    def release(self, conn):
+        # release() rolls back anything left open and drops connections that fail to.
+        self.pool.release(conn)
+
+    def insert_sql(self, table, columns, rows=1):
+        values = ', '.join([f"({', '.join('?' * len(columns))})"] * rows)
+        return f"INSERT INTO {table} ({', '.join(columns)}) OUTPUT INSERTED.id VALUES {values}"
+
+    def upsert_sql(self, table, keys, values, updates, rows=1, value_keys=()):
+        """MERGE keyed on ``keys``; see SqliteBackend.upsert_sql for the arguments."""
+        row = ', '.join([f'? AS {key}' for key in keys] + [f'{expr} AS {column}' for column, expr in values.items()])
+        source = ' UNION ALL '.join([f'SELECT {row}'] * rows)
+        match = ' AND '.join(f'{table}.{key} = excluded.{key}' for key in list(keys) + list(value_keys))
+        columns = list(keys) + list(values)
+        assignments = ', '.join(f'{column} = {expr}' for column, expr in updates.items())
+        return f'''
+            MERGE {table} WITH (HOLDLOCK)
+            USING ({source}) AS excluded
+            ON {match}
+            WHEN MATCHED THEN UPDATE SET {assignments}
+            WHEN NOT MATCHED THEN INSERT ({', '.join(columns)})
+                VALUES ({', '.join(f'excluded.{column}' for column in columns)});
+        '''
+
+    def byte_length_sql(self, expr):
+        return f'CAST(DATALENGTH({expr}) AS BIGINT)'
+
+    def stats(self):
+        return self.pool.stats()
+
+    def close(self):
+        self.pool.close()
+
+
+class SqliteBackend:
+    """Embedded SQLite in WAL mode with one cached connection per thread."""
+
+    name = 'sqlite'
+    limit_clause = 'LIMIT ?'
+    page_clause = 'LIMIT ?, ?'
+    current_date = 'CURRENT_DATE'
+    Error = sqlite3.Error
+    IntegrityError = sqlite3.IntegrityError
+
+    def __init__(self, path, busy_timeout=5.0, statement_cache=256, mmap_size=256 * 1024 * 1024,
+                 cache_size_kb=16 * 1024, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.busy_timeout = busy_timeout
+        self.statement_cache = statement_cache
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+
+        _register_converters()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Thread -> its cached connection, so close() reaches every thread's
+        self._connections = {}
+        self._stats = {
+            'connections_created': 0,
+            'checkouts': 0,
+            'nested_checkouts': 0,
+        }
+
+        conn = self._connect()
+        if not readonly:
+            # WAL is a property of the database file, so setting it once is enough.
+            conn.execute('PRAGMA journal_mode=WAL')
+        conn.close()
+
+    def _connect(self):
+        # Read-only (replica) connections fail instead of creating a missing file.
+        database = f'file:{quote(self.path)}?mode=ro' if self.readonly else self.path
+        conn = sqlite3.connect(
+            database,
+            timeout=self.busy_timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            factory=_SqliteConnection,
+            cached_statements=self.statement_cache,
+            uri=self.readonly,
+            # Still used by one thread at a time, but closed by whichever calls close()
+            check_same_thread=False
+        )
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute(f'PRAGMA cache_size=-{int(self.cache_size_kb)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        with self._lock:
+            self._stats['connections_created'] += 1
+        return conn
+
+    def _track(self, thread, conn):
+        # Connections left behind by threads that have exited are closed as new ones open
+        with self._lock:
+            exited = [other for other in self._connections if not other.is_alive()]
+            stale = [self._connections.pop(other) for other in exited]
+            self._connections[thread] = conn
+        for old in stale:
+            old.close()
+
+    def acquire(self):
+        if getattr(self._local, 'busy', False):
+            # Nested use on one thread gets its own connection so transactions stay separate.
+            with self._lock:
+                self._stats['nested_checkouts'] += 1
+            return self._connect()
+        thread = threading.current_thread()
+        conn = getattr(self._local, 'conn', None)
+        with self._lock:
+            self._stats['checkouts'] += 1
+            if self._connections.get(thread) is not conn:
+                # close() has closed it
+                conn = None
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            self._track(thread, conn)
+        self._local.busy = True
+        return conn
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            pass
+        if conn is getattr(self._local, 'conn', None):
+            self._local.busy = False
+        else:
+            conn.close()
+
+    def insert_sql(self, table, columns, rows=1):
+        values = ', '.join([f"({', '.join('?' * len(columns))})"] * rows)
+        return f"INSERT INTO {table} ({', '.join(columns)}) VALUES {values} RETURNING id"
+
+    def upsert_sql(self, table, keys, values, updates, rows=1, value_keys=()):
+        """Insert-or-update keyed on ``keys``.
+
+        ``keys`` are bound as parameters, followed by the ``?`` markers inside the
+        ``values`` expressions ({column: sql}), repeated for each of ``rows`` rows
+        (whose keys must be distinct). ``value_keys`` names columns of ``values``
+        that are also part of the key, e.g. a date computed in SQL. ``updates``
+        ({column: sql}) apply to an existing row; ``excluded.<column>`` is the new
+        value and ``<table>.<column>`` the current one.
+        """
+        columns = list(keys) + list(values)
+        placeholders = ['?'] * len(keys) + list(values.values())
+        assignments = ', '.join(f'{column} = {expr}' for column, expr in updates.items())
+        row = f"({', '.join(placeholders)})"
+        return f'''
+            INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([row] * rows)}
+            ON CONFLICT ({', '.join(list(keys) + list(value_keys))}) DO UPDATE SET {assignments}
+        '''
+
+    def byte_length_sql(self, expr):
+        # LENGTH() counts characters for TEXT; the BLOB cast counts stored bytes.
+        return f'LENGTH(CAST({expr} AS BLOB))'
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._connections)
+        stats['path'] = self.path
+        stats['readonly'] = self.readonly
+        return stats
+
+    def close(self):
+        """Close the cached connection of every thread; each opens a new one on next use."""
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for conn in connections:
+            conn.close()
+        self._local.conn = None
@@ -0,0 +1,302 @@
+"""Micro-benchmarks for database.py.
+
+Each dataset is a database the functions below are timed against: 'bundled'
+is a scratch copy of community.db, a number is a SQLite file generated by
+datagen.py with that many posts (created once per size and seed under
+BENCH_DIR, then reused), and 'server' is whatever database the configured
+backend points at. Results are written as JSON so runs from two commits can
+be compared with --compare.
+
+    python benchmark.py                                 # bundled, 10000 and 100000 posts
+    python benchmark.py --datasets 10000 100000 1000000 --output before.json
+    python benchmark.py --backend mssql --datasets server --generate 100000
+    python benchmark.py --compare before.json after.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import database
+import datagen
+
+BENCH_DIR = os.environ.get('BENCH_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench'))
+BUNDLED_DB = database.SQLITE_PATH
+DEFAULT_DATASETS = ['bundled', '10000', '100000']
+WARMUP = 3
+ITERATIONS = 30
+# --compare flags a case whose median got this much slower
+REGRESSION_THRESHOLD = 0.2
+
+_COUNTED_TABLES = ('users', 'posts', 'comments', 'reactions', 'chat_history', 'search_history', 'veterinarians')
+
+def _scalar(sql, params=()):
+    with database.get_db_cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+def _top(sql):
+    # First column of the first row of an ORDER BY ... DESC query
+    return _scalar(f"{sql} {database.get_backend().limit_clause}", (1,))
+
+def _context(rng):
+    """Ids the cases run against: the busiest rows, where skew hurts most, and
+    a random sample for typical ones."""
+    with database.get_db_cursor() as cursor:
+        cursor.execute("SELECT id FROM posts")
+        post_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT id, email FROM users")
+        users = cursor.fetchall()
+        cursor.execute("SELECT DISTINCT user_id FROM chat_sessions")
+        chatters = [row[0] for row in cursor.fetchall()]
+    if not post_ids or not users:
+        raise ValueError("Dataset has no posts or users")
+
+    pages = [database.get_all_posts()]
+    for _ in range(4):
+        cursor_token = database.get_next_feed_cursor(pages[-1])
+        if not cursor_token:
+            break
+        pages.append(database.get_all_posts(before=cursor_token))
+
+    rare_term = _top("SELECT term FROM search_terms WHERE doc_count > 1 ORDER BY doc_count ASC, term")
+    latest_post = _scalar("SELECT MAX(created_at) FROM posts")
+    if isinstance(latest_post, str):
+        latest_post = datetime.fromisoformat(latest_post)
+    return {
+        'post_ids': post_ids,
+        'user_ids': [user[0] for user in users],
+        'email': rng.choice(users)[1],
+        'deep_cursor': database.get_next_feed_cursor(pages[-2]) if len(pages) > 1 else None,
+        'cluster': _top("SELECT cluster FROM cluster_stats ORDER BY post_count DESC, cluster"),
+        'viral_post': _top("SELECT post_id FROM comments GROUP BY post_id ORDER BY COUNT(*) DESC, post_id"),
+        'heavy_chatter': _top("SELECT user_id FROM chat_sessions GROUP BY user_id ORDER BY SUM(message_count) DESC, user_id"),
+        'chatter': rng.choice(chatters) if chatters else None,
+        'heavy_searcher': _top(
+            "SELECT user_id FROM search_history WHERE user_id IS NOT NULL GROUP BY user_id ORDER BY COUNT(*) DESC, user_id"
+        ),
+        'common_term': _top("SELECT term FROM search_terms ORDER BY doc_count DESC, term"),
+        'rare_term': rare_term,
+        # Generated data ends at datagen.DATA_END, so date-windowed reads look
+        # back from the newest post rather than from today
+        'latest_post': latest_post,
+    }
+
+def _toggle_case(context, rng, iterations):
+    # Toggles random (user, post) pairs, then puts each pair's original reaction
+    # back untimed so the dataset is unchanged for the next run.
+    pairs = [(rng.choice(context['user_ids']), rng.choice(context['post_ids'])) for _ in range(iterations)]
+    original = {pair: database.get_user_reaction(*pair) for pair in set(pairs)}
+    state = iter(pairs)
+    def call():
+        user_id, post_id = next(state)
+        database.toggle_reaction(user_id, post_id, 'like')
+    def restore():
+        for (user_id, post_id), reaction in original.items():
+            current = database.get_user_reaction(user_id, post_id)
+            if current != reaction:
+                # Toggling the current type removes it; any other type sets that type
+                database.toggle_reaction(user_id, post_id, reaction or current)
+    return call, restore
+
+# (case, function, builder, cold): builder(context) returns the call to time,
+# and a cold case clears the feed and user caches before each call.
+CASES = [
+    ('get_all_posts', 'get_all_posts', lambda c: lambda: database.get_all_posts(), True),
+    ('get_all_posts/cached', 'get_all_posts', lambda c: lambda: database.get_all_posts(), False),
+    ('get_all_posts/page_5', 'get_all_posts', lambda c: lambda: database.get_all_posts(before=c['deep_cursor']), True),
+    ('get_posts_by_cluster', 'get_posts_by_cluster', lambda c: lambda: database.get_posts_by_cluster(c['cluster']), True),
+    ('get_comments_for_post/viral', 'get_comments_for_post',
+     lambda c: lambda: database.get_comments_for_post(c['viral_post']), False),
+    ('get_all_clusters', 'get_all_clusters', lambda c: database.get_all_clusters, True),
+    ('get_trending_clusters', 'get_trending_clusters',
+     lambda c: lambda: database.get_trending_clusters(today=c['latest_post']), True),
+    ('get_chat_sessions/heavy', 'get_chat_sessions', lambda c: lambda: database.get_chat_sessions(c['heavy_chatter']), False),
+    ('get_chat_sessions/typical', 'get_chat_sessions', lambda c: lambda: database.get_chat_sessions(c['chatter']), False),
+    ('get_chat_history/heavy', 'get_chat_history', lambda c: lambda: database.get_chat_history(c['heavy_chatter']), False),
+    ('get_search_history/heavy', 'get_search_history',
+     lambda c: lambda: database.get_search_history(c['heavy_searcher']), False),
+    ('search_posts/common', 'search_posts', lambda c: lambda: database.search_posts(c['common_term']), False),
+    ('search_posts/two_terms', 'search_posts',
+     lambda c: lambda: database.search_posts(f"{c['common_term']} {c['rare_term']}"), False),
+    ('get_user_by_email', 'get_user_by_email', lambda c: lambda: database.get_user_by_email(c['email']), True),
+    ('get_user_by_email/cached', 'get_user_by_email', lambda c: lambda: database.get_user_by_email(c['email']), False),
+]
+
+def _time_case(call, cold, iterations, warmup):
+    durations = []
+    statements = 0
+    for iteration in range(warmup + iterations):
+        if cold:
+            database.clear_feed_cache()
+            database.clear_user_cache()
+        database.begin_request_stats()
+        started = time.perf_counter()
+        call()
+        elapsed = time.perf_counter() - started
+        request = database.end_request_stats()
+        if iteration >= warmup:
+            durations.append(elapsed * 1000)
+            statements += request['statements']
+    durations.sort()
+    return {
+        'iterations': iterations,
+        'mean_ms': round(statistics.fmean(durations), 4),
+        'median_ms': round(statistics.median(durations), 4),
+        'p95_ms': round(durations[max(0, int(round(0.95 * len(durations))) - 1)], 4),
+        'min_ms': round(durations[0], 4),
+        'max_ms': round(durations[-1], 4),
+        'statements_per_call': statements / iterations,
+    }
+
+def _row_counts():
+    return {table: _scalar(f"SELECT COUNT(*) FROM {table}") for table in _COUNTED_TABLES}
+
+def run_dataset(name, seed=datagen.DEFAULT_SEED, iterations=ITERATIONS, warmup=WARMUP, cases=None, progress=print):
+    """Time every case against the currently configured database."""
+    rng = random.Random(seed)
+    database.init_db()
+    context = _context(rng)
+    results = []
+    for case, function, build, cold in CASES:
+        if cases and case not in cases and function not in cases:
+            continue
+        stats = _time_case(build(context), cold, iterations, warmup)
+        results.append(dict(case=case, function=function, **stats))
+        if progress:
+            progress(f"{name:>10} {case:<32} median {stats['median_ms']:9.3f} ms  p95 {stats['p95_ms']:9.3f} ms")
+    if not cases or 'toggle_reaction' in cases:
+        call, restore = _toggle_case(context, rng, warmup + iterations)
+        stats = _time_case(call, False, iterations, warmup)
+        restore()
+        results.append(dict(case='toggle_reaction', function='toggle_reaction', **stats))
+        if progress:
+            progress(f"{name:>10} {'toggle_reaction':<32} median {stats['median_ms']:9.3f} ms  p95 {stats['p95_ms']:9.3f} ms")
+    return {'name': name, 'rows': _row_counts(), 'results': results}
+
+def _open_dataset(name, backend, seed, generate, progress):
+    """Point database.py at the dataset, generating it first if needed."""
+    if name == 'server':
+        database.configure_database(backend)
+        if generate:
+            datagen.generate(generate, seed, progress)
+        return
+    if name == 'bundled':
+        os.makedirs(BENCH_DIR, exist_ok=True)
+        path = os.path.join(BENCH_DIR, 'bundled.db')
+        shutil.copyfile(BUNDLED_DB, path)
+        database.configure_database('sqlite', path=path)
+        return
+    if not name.isdigit():
+        raise ValueError(f"Unknown dataset: {name}")
+    path = os.path.join(BENCH_DIR, f"posts-{name}-seed{seed}.db")
+    if not os.path.exists(path):
+        # Generate under a temporary name so an interrupted run is not reused
+        partial = path + '.partial'
+        os.makedirs(BENCH_DIR, exist_ok=True)
+        for leftover in (partial, partial + '-wal', partial + '-shm'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        database.configure_database('sqlite', path=partial)
+        datagen.generate(int(name), seed, progress)
+        database.get_backend().close()
+        os.replace(partial, path)
+    database.configure_database('sqlite', path=path)
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(datasets=None, backend='sqlite', seed=datagen.DEFAULT_SEED, iterations=ITERATIONS, warmup=WARMUP,
+        cases=None, generate=None, progress=print):
+    database.configure_replica(None)
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'backend': backend,
+        'seed': seed,
+        'datasets': [],
+    }
+    for name in datasets or DEFAULT_DATASETS:
+        _open_dataset(name, backend, seed, generate, progress)
+        report['datasets'].append(run_dataset(name, seed, iterations, warmup, cases, progress))
+    return report
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """Median change per (dataset, case); returns (rows, regressions)."""
+    before = {(dataset['name'], result['case']): result
+              for dataset in baseline['datasets'] for result in dataset['results']}
+    rows = []
+    regressions = []
+    for dataset in current['datasets']:
+        for result in dataset['results']:
+            old = before.get((dataset['name'], result['case']))
+            if old is None:
+                continue
+            change = (result['median_ms'] - old['median_ms']) / old['median_ms'] if old['median_ms'] else 0.0
+            row = {
+                'dataset': dataset['name'],
+                'case': result['case'],
+                'before_ms': old['median_ms'],
+                'after_ms': result['median_ms'],
+                'change': round(change, 4),
+                'statements_before': old['statements_per_call'],
+                'statements_after': result['statements_per_call'],
+            }
+            rows.append(row)
+            if change > threshold:
+                regressions.append(row)
+    return rows, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time database.py functions across dataset sizes.')
+    parser.add_argument('--datasets', nargs='+', help="'bundled', 'server' or a post count (default: %(default)s)",
+                        default=DEFAULT_DATASETS)
+    parser.add_argument('--backend', choices=('mssql', 'sqlite'), default='sqlite',
+                        help="backend for the 'server' dataset")
+    parser.add_argument('--generate', type=int, metavar='POSTS', help="load synthetic data into 'server' first")
+    parser.add_argument('--seed', type=int, default=datagen.DEFAULT_SEED)
+    parser.add_argument('--iterations', type=int, default=ITERATIONS)
+    parser.add_argument('--warmup', type=int, default=WARMUP)
+    parser.add_argument('--cases', nargs='+', help='case or function names to run (default: all)')
+    parser.add_argument('--output', help='results file (default: BENCH_DIR/results-<time>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'))
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0], encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.compare[1], encoding='utf-8') as f:
+            current = json.load(f)
+        rows, regressions = compare(baseline, current, args.threshold)
+        for row in rows:
+            flag = '  REGRESSION' if row in regressions else ''
+            print(f"{row['dataset']:>10} {row['case']:<32} {row['before_ms']:9.3f} -> {row['after_ms']:9.3f} ms "
+                  f"({row['change']:+.1%}){flag}")
+        sys.exit(1 if regressions else 0)
+
+    report = run(args.datasets, args.backend, args.seed, args.iterations, args.warmup, args.cases, args.generate)
+    output = args.output or os.path.join(BENCH_DIR, f"results-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Results written to {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a TTL and tag-based invalidation.
+
+    Entries can carry tags (e.g. 'post:42'); invalidate_tags() drops every
+    entry sharing one of them. A load that overlaps an invalidation is not
+    stored, so a slow reader can never put back data a writer just replaced.
+    """
+
+    def __init__(self, max_size=256, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+        }
+
+    def _remove(self, key):
+        value, expires_at, tags = self._data.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return default
+            if entry[1] <= time.monotonic():
+                self._remove(key)
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return default
+            self._data.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[0]
+
+    def set(self, key, value, tags=(), generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            if key in self._data:
+                self._remove(key)
+            tags = frozenset(tags)
+            self._data[key] = (value, time.monotonic() + self.ttl, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._data) > self.max_size:
+                self._remove(next(iter(self._data)))
+                self._stats['evictions'] += 1
+            return True
+
+    def get_or_load(self, key, loader, tags=()):
+        """Return the cached value for ``key`` or call ``loader()`` and cache it.
+
+        ``tags`` may be a callable that derives the tags from the loaded value.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            generation = self._generation
+        value = loader()
+        self.set(key, value, tags(value) if callable(tags) else tags, generation=generation)
+        return value
+
+    def get_or_load_many(self, keys, loader, tags=()):
+        """Bulk get_or_load(): ``loader(missing_keys)`` returns a dict of the values
+        it found. Keys it leaves out are neither returned nor cached.
+        """
+        values = {}
+        missing = []
+        for key in keys:
+            value = self.get(key, _MISSING)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                values[key] = value
+        if missing:
+            with self._lock:
+                generation = self._generation
+            loaded = loader(missing)
+            for key, value in loaded.items():
+                self.set(key, value, tags(value) if callable(tags) else tags, generation=generation)
+            values.update(loaded)
+        return values
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if key in self._data:
+                    self._remove(key)
+                    self._stats['invalidations'] += 1
+
+    def invalidate_tags(self, *tags):
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self._stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+            self._tags.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._data)
+        stats['max_size'] = self.max_size
+        stats['ttl'] = self.ttl
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
@@ -2,17 +2,63 @@ from deep_translator import GoogleTranslator
 from pypdf import PdfReader
 from pptx import Presentation
 import json
+import copy
+import hashlib
+import threading
+import time
+from collections import deque
+import httpx
+import openai
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from transformers import pipeline
 from langchain.llms import HuggingFacePipeline
 from langchain import PromptTemplate
 import os
 from langchain.vectorstores import FAISS
-from langchain.chains import RetrievalQA
+import faiss
 from langchain_openai import ChatOpenAI
 from langchain_community.embeddings import HuggingFaceEmbeddings
+from answer_cache import SemanticAnswerCache
 
 os.environ["OPENAI_API_KEY"] =#this is Api key 
+
+DATA_FOLDER = os.environ.get('CHATBOT_DATA_DIR', './data')
+# The FAISS index and docstore are saved here and reused while the manifest matches
+INDEX_DIR = os.environ.get('CHATBOT_INDEX_DIR', './faiss_index')
+MANIFEST_FILE = 'manifest.json'
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+# Bump when reading or splitting changes in a way the settings above do not capture
+INDEX_FORMAT = 2
+# Seconds between data folder scans by KnowledgeBase.start_watcher(); 0 turns it off
+KB_WATCH_INTERVAL = float(os.environ.get('CHATBOT_WATCH_INTERVAL', 0))
+# Longest a chatbot request waits for the warm-up before getting a "warming up" reply
+KB_WARMUP_WAIT = float(os.environ.get('CHATBOT_WARMUP_WAIT', 3))
+LLM_MODEL = "gpt-4o-mini"
+LLM_TIMEOUT = float(os.environ.get('CHATBOT_LLM_TIMEOUT', 30))
+# Kept-alive HTTPS connections to the LLM endpoint, shared by all requests
+LLM_MAX_CONNECTIONS = int(os.environ.get('CHATBOT_LLM_CONNECTIONS', 20))
+# Recent answers kept per stage for the p50/p95 timings
+TIMING_SAMPLE_SIZE = 1000
+# Answers reused for questions whose embeddings are at least this similar (cosine)
+ANSWER_CACHE_FILE = os.environ.get('CHATBOT_ANSWER_CACHE', os.path.join(INDEX_DIR, 'answers.npz'))
+ANSWER_CACHE_SIZE = int(os.environ.get('CHATBOT_ANSWER_CACHE_SIZE', 2000))
+ANSWER_CACHE_TTL = int(os.environ.get('CHATBOT_ANSWER_CACHE_TTL', 86400))
+ANSWER_CACHE_THRESHOLD = float(os.environ.get('CHATBOT_ANSWER_CACHE_THRESHOLD', 0.92))
+# Indexed only while no file in the data folder yields any text
+FALLBACK_SOURCE = '<built-in>'
+FALLBACK_TEXT = """
+Cat Care Information:
+- Cats need regular veterinary checkups
+- Provide fresh water and balanced nutrition
+- Keep litter boxes clean
+- Regular grooming is important
+- Provide scratching posts and toys
+- Spay/neuter your cats
+- Watch for signs of illness
+"""
+
 def read_pdf(file_path):
     reader = PdfReader(file_path)
     text = ''
@@ -69,8 +115,8 @@ def return_content(file_path):
 
 def split_text(text):
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=100,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
         length_function=len,
     )
     docs = text_splitter.create_documents([text])
@@ -89,67 +135,545 @@ def custom_prompt_forall():
     answer:
     """
 
-def initialize_chatbot():
-    """Initialize the chatbot with data from the data folder"""
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_files(data_folder=DATA_FOLDER):
+    if not os.path.exists(data_folder):
+        return []
+    return sorted(
+        os.path.join(data_folder, filename) for filename in os.listdir(data_folder)
+        if os.path.isfile(os.path.join(data_folder, filename))
+    )
+
+def index_settings():
+    """Everything besides the files that the saved index depends on."""
+    return {
+        'format': INDEX_FORMAT,
+        'embedding_model': EMBEDDING_MODEL,
+        'chunk_size': CHUNK_SIZE,
+        'chunk_overlap': CHUNK_OVERLAP,
+    }
+
+def manifest_version(manifest):
+    return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+def read_manifest(index_dir=INDEX_DIR):
     try:
-        data_folder = "./data"
-        all_text = ""
-        
-        # Read all files in the data folder
-        if os.path.exists(data_folder):
-            for filename in os.listdir(data_folder):
-                file_path = os.path.join(data_folder, filename)
-                if os.path.isfile(file_path):
-                    try:
-                        file_content = return_content(file_path)
-                        all_text += file_content + "\n\n"
-                    except Exception as e:
-                        print(f"Could not read {filename}: {e}")
-        
-        if not all_text.strip():
-            # Fallback content if no files are found
-            all_text = """
-            Cat Care Information:
-            - Cats need regular veterinary checkups
-            - Provide fresh water and balanced nutrition
-            - Keep litter boxes clean
-            - Regular grooming is important
-            - Provide scratching posts and toys
-            - Spay/neuter your cats
-            - Watch for signs of illness
-            """
-        
-        # Split text and create embeddings
-        docs = split_text(all_text)
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-        db = FAISS.from_documents(docs, embeddings)
-        
-        return db
-        
-    except Exception as e:
+        with open(os.path.join(index_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
         return None
 
-def get_chatbot_response(user_query, db):
-    """Get response from chatbot"""
-    if not db:
-        return "I'm sorry, the chatbot is not available at the moment. Please try again later."
-    
-    try:
-        # Use OpenAI model
-        llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0)
-        custom_prompt_template = custom_prompt_forall()
-        custom_prompt = PromptTemplate(template=custom_prompt_template, input_variables=["context", "question"])
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            chain_type="stuff",
-            retriever=db.as_retriever(),
-            chain_type_kwargs={"prompt": custom_prompt}
+def save_index(db, manifest, index_dir=INDEX_DIR):
+    # The manifest goes last, so an interrupted save is never mistaken for a valid index
+    manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    db.save_local(index_dir)
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def _apply(db, added, stale):
+    """``db`` with the store ``added`` merged in and the ``stale`` ids deleted.
+
+    ``db`` keeps answering questions unchanged. Documents are shared with it and
+    only the containers that change are copied: the docstore and id mapping
+    shallowly, and the vectors, which faiss edits in place, when any are added
+    or deleted.
+    """
+    if db is None:
+        return added
+    if added is None and not stale:
+        return db
+    store = copy.copy(db)
+    store.index = faiss.clone_index(db.index)
+    store.docstore = copy.copy(db.docstore)
+    store.docstore._dict = dict(db.docstore._dict)
+    store.index_to_docstore_id = dict(db.index_to_docstore_id)
+    if added is not None:
+        store.merge_from(added)
+    if stale:
+        store.delete(stale)
+    return store
+
+
+class KnowledgeBase:
+    """The chatbot's FAISS store, kept in step with the data folder file by file.
+
+    The manifest saved with the index records each file's sha256 and the ids
+    of its chunks. refresh() embeds only new or changed files and deletes the
+    chunks of changed or removed ones, on a copy of the live store; the copy
+    is swapped in under a lock, so questions are answered from the old store
+    until the new one is complete. Refreshes embed without holding any lock;
+    one that finds the store swapped meanwhile starts over from the new store.
+    """
+
+    def __init__(self, data_folder=DATA_FOLDER, index_dir=INDEX_DIR):
+        self.data_folder = data_folder
+        self.index_dir = index_dir
+        self.db = None
+        self.version = None
+        self._manifest = None
+        self._embeddings = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._hashes = {}
+        self._watcher = None
+        self._stop = threading.Event()
+        self._warmer = None
+        # Set once a store is available to answer questions
+        self.ready = threading.Event()
+        self.warmup = {
+            'state': 'pending',
+            'stage': None,
+            'files_done': 0,
+            'files_total': 0,
+            'started': None,
+            'finished': None,
+            'error': None
+        }
+        self.stats = {
+            'refreshes': 0,
+            'last_refresh': None,
+            'last_changes': None,
+            'last_duration_s': None,
+            'last_error': None
+        }
+
+    def _progress(self, **fields):
+        # Refreshes after warm-up leave the warm-up report as it ended
+        if self.warmup['state'] == 'warming':
+            self.warmup.update(fields)
+
+    def embeddings(self):
+        if self._embeddings is None:
+            self._embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+        return self._embeddings
+
+    def _file_hash(self, path):
+        # Re-hash only files whose size or mtime changed since the last look
+        stat = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+        digest = file_sha256(path)
+        self._hashes[path] = (stat.st_size, stat.st_mtime_ns, digest)
+        return digest
+
+    def _read(self, name):
+        if name == FALLBACK_SOURCE:
+            return FALLBACK_TEXT
+        try:
+            return return_content(os.path.join(self.data_folder, name))
+        except Exception as e:
+            print(f"Could not read {name}: {e}")
+            return ''
+
+    def _embed(self, db, name, digest):
+        """Add ``name``'s chunks to ``db`` (created when None); returns (db, ids)."""
+        docs = split_text(self._read(name))
+        if not docs:
+            return db, []
+        ids = [f"{name}#{digest[:12]}#{number}" for number in range(len(docs))]
+        for doc in docs:
+            doc.metadata['source'] = name
+        if db is None:
+            self._progress(stage='loading_model')
+            embeddings = self.embeddings()
+            self._progress(stage='embedding')
+            return FAISS.from_documents(docs, embeddings, ids=ids), ids
+        db.add_documents(docs, ids=ids)
+        return db, ids
+
+    def snapshot(self):
+        """The current store and its version, read together."""
+        with self._lock:
+            return self.db, self.version
+
+    def _swap(self, db, manifest):
+        with self._lock:
+            self.db, self._manifest, self.version = db, manifest, manifest_version(manifest)
+        self.ready.set()
+
+    def _commit(self, db, manifest, base, save=True):
+        """Save and swap in ``db`` if the live store is still version ``base``;
+        returns False when another refresh swapped first."""
+        with self._refresh_lock:
+            if self.version != base:
+                return False
+            if save:
+                self._progress(stage='saving')
+                try:
+                    save_index(db, manifest, self.index_dir)
+                except OSError as e:
+                    print(f"Could not save the index: {e}")
+            self._swap(db, manifest)
+            return True
+
+    def load(self):
+        """Load the saved index when its settings still apply, then catch up with
+        the data folder; only files changed since the save are embedded."""
+        manifest = read_manifest(self.index_dir)
+        if manifest and manifest.get('settings') == index_settings():
+            try:
+                self._progress(stage='loading_model')
+                embeddings = self.embeddings()
+                self._progress(stage='loading_index')
+                self._commit(FAISS.load_local(self.index_dir, embeddings), manifest, None, save=False)
+            except Exception as e:
+                print(f"Could not load the saved index: {e}")
+        return self._timed_refresh()
+
+    def refresh(self):
+        """Apply data folder changes; returns the files added, updated and removed."""
+        return self._timed_refresh()
+
+    def _timed_refresh(self):
+        started = time.perf_counter()
+        try:
+            changes = self._refresh()
+        except Exception as e:
+            self.stats['last_error'] = str(e)
+            raise
+        self.stats['refreshes'] += 1
+        self.stats['last_refresh'] = time.time()
+        self.stats['last_changes'] = changes
+        self.stats['last_duration_s'] = round(time.perf_counter() - started, 3)
+        self.stats['last_error'] = None
+        return changes
+
+    def _refresh(self):
+        while True:
+            with self._lock:
+                base_db, base_manifest, base = self.db, self._manifest, self.version
+            changes, db, manifest = self._build(base_db, base_manifest)
+            if manifest is base_manifest or self._commit(db, manifest, base):
+                return changes
+
+    def _build(self, base_db, base_manifest):
+        """The store and manifest for the data folder, starting from ``base_db``;
+        returns (changes, db, manifest) with ``base_manifest`` itself when nothing changed."""
+        old_files = base_manifest['files'] if base_manifest and base_db is not None else {}
+        # Hashed before reading, so a file edited mid-refresh is picked up next time
+        current = {os.path.basename(path): self._file_hash(path) for path in source_files(self.data_folder)}
+        changes = {
+            'added': sorted(name for name in current if name not in old_files),
+            'updated': sorted(name for name in current if name in old_files and old_files[name]['sha256'] != current[name]),
+            'removed': sorted(name for name in old_files if name not in current and name != FALLBACK_SOURCE),
+        }
+        if not any(changes.values()) and base_db is not None:
+            return changes, base_db, base_manifest
+
+        # New chunks go into a store of their own, merged into a copy at the end
+        added = None
+        files = {name: entry for name, entry in old_files.items() if name in current or name == FALLBACK_SOURCE}
+        stale = [chunk for name in changes['updated'] + changes['removed'] for chunk in old_files[name]['ids']]
+        pending = changes['added'] + changes['updated']
+        self._progress(stage='embedding', files_done=0, files_total=len(pending))
+        for number, name in enumerate(pending, 1):
+            added, ids = self._embed(added, name, current[name])
+            files[name] = {'sha256': current[name], 'ids': ids}
+            self._progress(files_done=number)
+
+        # The built-in notes stand in only while no file yields any text
+        has_text = any(entry['ids'] for name, entry in files.items() if name != FALLBACK_SOURCE)
+        if has_text and FALLBACK_SOURCE in files:
+            stale.extend(files.pop(FALLBACK_SOURCE)['ids'])
+        elif not has_text and FALLBACK_SOURCE not in files:
+            fallback_digest = hashlib.sha256(FALLBACK_TEXT.encode('utf-8')).hexdigest()
+            added, ids = self._embed(added, FALLBACK_SOURCE, fallback_digest)
+            files[FALLBACK_SOURCE] = {'sha256': fallback_digest, 'ids': ids}
+
+        return changes, _apply(base_db, added, stale), {'settings': index_settings(), 'files': files}
+
+    def start_warmup(self):
+        """Run load() on a background thread so the web tier can serve meanwhile.
+
+        Progress is kept in ``warmup``; ``ready`` is set as soon as a store can
+        answer questions, which may be before the catch-up refresh has finished.
+        """
+        if self._warmer is not None:
+            return
+        def warm():
+            self.warmup.update(state='warming', started=time.time())
+            try:
+                self.load()
+                self.warmup.update(state='ready', stage=None)
+            except Exception as e:
+                self.warmup.update(state='failed', error=str(e))
+                print(f"Knowledge base warm-up failed: {e}")
+            self.warmup['finished'] = time.time()
+        self._warmer = threading.Thread(target=warm, name='knowledge-base-warmup', daemon=True)
+        self._warmer.start()
+
+    def warming_up(self):
+        return self._warmer is not None and self._warmer.is_alive()
+
+    def start_watcher(self, interval=KB_WATCH_INTERVAL):
+        """Poll the data folder every ``interval`` seconds; 0 disables polling."""
+        if not interval or self._watcher is not None:
+            return
+        def watch():
+            while not self._stop.wait(interval):
+                if self.warming_up():
+                    continue
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Knowledge base refresh failed: {e}")
+        self._stop.clear()
+        self._watcher = threading.Thread(target=watch, name='knowledge-base-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    def status(self):
+        with self._lock:
+            files = dict(self._manifest['files']) if self._manifest else {}
+            version = self.version
+        return dict(
+            self.stats,
+            version=version,
+            available=self.db is not None,
+            warmup=dict(self.warmup),
+            watching=self._watcher is not None,
+            files={name: len(entry['ids']) for name, entry in files.items()}
         )
-        
-        response = qa_chain.invoke({"query": user_query})
-        return response['result']
-            
+
+
+knowledge_base = KnowledgeBase()
+
+def initialize_chatbot():
+    """Load the knowledge base and bring it up to date with the data folder"""
+    try:
+        knowledge_base.load()
+        return knowledge_base.db
+
     except Exception as e:
-        return f"I can help with cat care questions! Based on your query '{user_query}', I recommend consulting veterinary resources for detailed information."
+        return None
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ChatbotEngine:
+    """Answers questions from a KnowledgeBase, reusing everything between messages.
+
+    The chat model and its pooled keep-alive HTTP client are created once, the
+    prompt template at construction and the retriever once per knowledge base
+    version. An answer is the same "stuff" chain RetrievalQA ran: retrieve,
+    fill the prompt with the chunks, call the LLM. Each stage is timed.
+    With an ``answer_cache``, repeated questions skip all three stages.
+    """
+
+    STAGES = ('retrieve', 'prompt', 'llm')
+
+    def __init__(self, knowledge_base, answer_cache=None):
+        self.knowledge_base = knowledge_base
+        self.answer_cache = answer_cache
+        self.prompt = PromptTemplate(template=custom_prompt_forall(), input_variables=["context", "question"])
+        self._lock = threading.Lock()
+        self._llm = None
+        self._client = None
+        self._retriever_version = None
+        self._retriever = None
+        self._timings = {stage: deque(maxlen=TIMING_SAMPLE_SIZE) for stage in self.STAGES + ('first_token', 'total')}
+        self.stats = {'answers': 0, 'cached_answers': 0, 'errors': 0, 'retriever_builds': 0}
 
-chatbot_db = initialize_chatbot()
\ No newline at end of file
+    def llm(self):
+        with self._lock:
+            if self._llm is None:
+                # ChatOpenAI would hand an http_client to its async client as well,
+                # so the pooled sync client is built here and passed in whole
+                self._client = openai.OpenAI(
+                    base_url=os.environ.get('OPENAI_API_BASE'),
+                    timeout=LLM_TIMEOUT,
+                    http_client=httpx.Client(
+                        limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+                        timeout=LLM_TIMEOUT
+                    )
+                )
+                self._llm = ChatOpenAI(model_name=LLM_MODEL, temperature=0, client=self._client.chat.completions)
+            return self._llm
+
+    def retriever(self):
+        """(retriever over the current store, its version); (None, None) while there is no store."""
+        with self._lock:
+            # Read under the lock, so new versions are seen here in the order they went live
+            db, version = self.knowledge_base.snapshot()
+            if db is None:
+                return None, None
+            if self._retriever is None or self._retriever_version != version:
+                self._retriever = db.as_retriever()
+                self._retriever_version = version
+                self.stats['retriever_builds'] += 1
+                if self.answer_cache is not None:
+                    self.answer_cache.use_version(version)
+            return self._retriever, version
+
+    def build_prompt(self, query, docs):
+        context = "\n\n".join(doc.page_content for doc in docs)
+        return self.prompt.format(context=context, question=query)
+
+    def _fallback(self, query):
+        with self._lock:
+            self.stats['errors'] += 1
+        return f"I can help with cat care questions! Based on your query '{query}', I recommend consulting veterinary resources for detailed information."
+
+    def _stages(self, timings):
+        last = time.perf_counter()
+        def mark(stage):
+            nonlocal last
+            now = time.perf_counter()
+            timings[stage] = round((now - last) * 1000, 2)
+            last = now
+        return mark
+
+    def _generate(self, query, retriever, timings):
+        """Run the chain; returns (text, whether the text is a real answer)."""
+        mark = self._stages(timings)
+        try:
+            docs = retriever.get_relevant_documents(query)
+            mark('retrieve')
+            prompt = self.build_prompt(query, docs)
+            mark('prompt')
+            text = self.llm().invoke(prompt).content
+            mark('llm')
+            return text, True
+        except Exception:
+            return self._fallback(query), False
+
+    def _record(self, timings, source):
+        with self._lock:
+            self.stats['answers'] += 1
+            if source != 'computed':
+                self.stats['cached_answers'] += 1
+            for stage, elapsed in timings.items():
+                self._timings[stage].append(elapsed)
+
+    def answer(self, query):
+        """Answer ``query``; returns (text, timings in ms per stage)."""
+        retriever, version = self.retriever()
+        if retriever is None:
+            return "I'm sorry, the chatbot is not available at the moment. Please try again later.", {}
+        timings = {}
+        started = time.perf_counter()
+        source = 'computed'
+        if self.answer_cache is None:
+            text = self._generate(query, retriever, timings)[0]
+        else:
+            try:
+                text, source = self.answer_cache.get_or_compute(query, version, lambda: self._generate(query, retriever, timings))
+            except Exception as e:
+                print(f"Answer cache failed: {e}")
+                text = self._generate(query, retriever, timings)[0]
+        timings['total'] = round((time.perf_counter() - started) * 1000, 2)
+        self._record(timings, source)
+        return text, timings
+
+    def stream(self, query):
+        """Like answer(), but yields the text in pieces as the LLM produces them.
+
+        A cached answer comes as a single piece. A generated one is stored in
+        the answer cache only if the stream ran to the end without errors.
+        """
+        retriever, version = self.retriever()
+        if retriever is None:
+            yield "I'm sorry, the chatbot is not available at the moment. Please try again later."
+            return
+        timings = {}
+        started = time.perf_counter()
+        text, source, flight = None, 'computed', None
+        if self.answer_cache is not None:
+            try:
+                text, source, flight = self.answer_cache.claim(query, version)
+            except Exception as e:
+                print(f"Answer cache failed: {e}")
+        if text is not None:
+            yield text
+            timings['first_token'] = timings['total'] = round((time.perf_counter() - started) * 1000, 2)
+            self._record(timings, source)
+            return
+
+        pieces = []
+        complete = False
+        mark = self._stages(timings)
+        try:
+            try:
+                docs = retriever.get_relevant_documents(query)
+                mark('retrieve')
+                prompt = self.build_prompt(query, docs)
+                mark('prompt')
+                for chunk in self.llm().stream(prompt):
+                    if chunk.content:
+                        if not pieces:
+                            timings['first_token'] = round((time.perf_counter() - started) * 1000, 2)
+                        pieces.append(chunk.content)
+                        yield chunk.content
+                mark('llm')
+                complete = True
+            except Exception:
+                fallback = self._fallback(query)
+                timings['total'] = round((time.perf_counter() - started) * 1000, 2)
+                self._record(timings, source)
+                if pieces:
+                    raise
+                # Nothing was sent yet, so the usual fallback reply can still go out
+                yield fallback
+                return
+        finally:
+            if flight is not None:
+                self.answer_cache.finish(flight, ''.join(pieces) if complete else None, complete)
+        timings['total'] = round((time.perf_counter() - started) * 1000, 2)
+        self._record(timings, source)
+
+    def status(self):
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._timings.items()}
+            stats = dict(self.stats, retriever_version=self._retriever_version)
+        stats['timings_ms'] = {
+            stage: {
+                'count': len(ordered),
+                'p50': _percentile(ordered, 0.50),
+                'p95': _percentile(ordered, 0.95)
+            }
+            for stage, ordered in samples.items()
+        }
+        return stats
+
+    def close(self):
+        if self.answer_cache is not None:
+            self.answer_cache.stop_saver()
+            self.answer_cache.save()
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+            self._llm = self._client = None
+
+
+answer_cache = SemanticAnswerCache(
+    lambda text: knowledge_base.embeddings().embed_query(text),
+    path=ANSWER_CACHE_FILE,
+    max_size=ANSWER_CACHE_SIZE,
+    ttl=ANSWER_CACHE_TTL,
+    threshold=ANSWER_CACHE_THRESHOLD,
+    wait_timeout=LLM_TIMEOUT
+)
+answer_cache.load()
+chatbot_engine = ChatbotEngine(knowledge_base, answer_cache)
+
+def get_chatbot_response(user_query):
+    """Get response from chatbot"""
+    return chatbot_engine.answer(user_query)[0]
\ No newline at end of file
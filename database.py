@@ -1,262 +1,408 @@
-import pyodbc
 import hashlib
 import json
-from datetime import datetime
+import math
+from collections import Counter
+from datetime import datetime, timedelta
+import base64
 import os
 from contextlib import contextmanager
+import threading
+from backends import SqlServerBackend, SqliteBackend
+from cache import LRUCache
+from fulltext import tokenize
+from instrumentation import InstrumentedCursor, QueryStats
+import time
+import migrations
+from write_behind import WriteBehindQueue
+
+# 'mssql' or 'sqlite'
+DB_BACKEND = os.environ.get('DB_BACKEND', 'mssql')
 
 SERVER = 'localhost'  
 DATABASE = 'cats_db'
 TRUSTED_CONNECTION = 'yes'  
 
-def get_connection_string():
-    return f'DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={SERVER};DATABASE={DATABASE};Trusted_Connection={TRUSTED_CONNECTION};'
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 10
+POOL_MAX_AGE = 1800
+POOL_TIMEOUT = 30
+POOL_PING_AFTER = 30
+
+SQLITE_PATH = os.environ.get('SQLITE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'community.db'))
+SQLITE_BUSY_TIMEOUT = 5.0
+SQLITE_STATEMENT_CACHE = 256
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+FEED_CACHE_SIZE = 256
+FEED_CACHE_TTL = 30
+
+# Users by id and by email; a user's entries are dropped when they change
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 600
+
+CHAT_QUEUE_SIZE = 1000
+CHAT_FLUSH_INTERVAL = 0.5
+CHAT_FLUSH_TIMEOUT = 2.0
+
+# Statements at or above this many milliseconds go to the 'database.slow_queries' logger
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+QUERY_STATS_SAMPLE_SIZE = 1000
+SLOW_QUERY_LOG_SIZE = 100
+
+# Read replica for pure readers; leave unset to keep all traffic on the primary
+REPLICA_SERVER = os.environ.get('DB_REPLICA_SERVER')
+SQLITE_REPLICA_PATH = os.environ.get('SQLITE_REPLICA_PATH')
+# A user's reads stay on the primary, uncached, this long after they write. Longer
+# than FEED_CACHE_TTL plus replica lag, so no stale cached page outlives the window.
+# The deadline travels with the user's session (see get_read_your_writes_deadline),
+# so every worker process honours it.
+READ_YOUR_WRITES_WINDOW = FEED_CACHE_TTL + 5
+# After a replica failure, readers use the primary for this many seconds
+REPLICA_RETRY_AFTER = 30
+
+_backend = None
+_backend_lock = threading.Lock()
+_replica = None
+_replica_config = None
+_replica_down_until = 0.0
+_routing_lock = threading.Lock()
+_request_user = threading.local()
+_routing_stats = {'replica_reads': 0, 'primary_reads': 0, 'failovers': 0}
+_feed_cache = LRUCache(FEED_CACHE_SIZE, FEED_CACHE_TTL)
+_user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+_query_stats = QueryStats(QUERY_STATS_SAMPLE_SIZE, SLOW_QUERY_MS, SLOW_QUERY_LOG_SIZE)
+
+def get_connection_string(server=None):
+    return f'DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server or SERVER};DATABASE={DATABASE};Trusted_Connection={TRUSTED_CONNECTION};'
+
+def create_backend(name=None, readonly=False, **options):
+    name = name or DB_BACKEND
+    if name == 'mssql':
+        settings = {
+            'min_size': POOL_MIN_SIZE,
+            'max_size': POOL_MAX_SIZE,
+            'max_age': POOL_MAX_AGE,
+            'timeout': POOL_TIMEOUT,
+            'ping_after': POOL_PING_AFTER
+        }
+        settings.update(options)
+        connection_string = settings.pop('connection_string', None) or get_connection_string()
+        if readonly:
+            connection_string += 'ApplicationIntent=ReadOnly;'
+        return SqlServerBackend(connection_string, **settings)
+    if name == 'sqlite':
+        settings = {
+            'busy_timeout': SQLITE_BUSY_TIMEOUT,
+            'statement_cache': SQLITE_STATEMENT_CACHE,
+            'mmap_size': SQLITE_MMAP_SIZE
+        }
+        settings.update(options)
+        path = settings.pop('path', None) or SQLITE_PATH
+        return SqliteBackend(path, readonly=readonly, **settings)
+    raise ValueError(f"Unknown database backend: {name}")
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+def configure_database(name=None, **options):
+    """Switch backends, e.g. configure_database('sqlite', path='bench.db') or
+    configure_database('mssql', max_size=20)."""
+    global _backend
+    new_backend = create_backend(name, **options)
+    _chat_writer.flush(CHAT_FLUSH_TIMEOUT)
+    with _backend_lock:
+        old_backend = _backend
+        _backend = new_backend
+    if old_backend:
+        old_backend.close()
+    _feed_cache.clear()
+    _user_cache.clear()
+    return new_backend
+
+def _default_replica_config():
+    if DB_BACKEND == 'sqlite':
+        return ('sqlite', {'path': SQLITE_REPLICA_PATH}) if SQLITE_REPLICA_PATH else None
+    if REPLICA_SERVER:
+        return ('mssql', {'connection_string': get_connection_string(REPLICA_SERVER)})
+    return None
+
+def configure_replica(name=None, **options):
+    """Route pure reads to a replica, e.g. configure_replica('sqlite', path='replica.db')
+    or configure_replica('mssql', connection_string=...); configure_replica(None) turns it off."""
+    global _replica, _replica_config, _replica_down_until
+    with _backend_lock:
+        old_replica = _replica
+        _replica = None
+        _replica_config = (name, options) if name else False
+        _replica_down_until = 0.0
+    if old_replica:
+        old_replica.close()
+
+def _replica_enabled():
+    config = _default_replica_config() if _replica_config is None else _replica_config
+    return bool(config)
+
+def _mark_replica_down():
+    global _replica_down_until
+    _replica_down_until = time.monotonic() + REPLICA_RETRY_AFTER
+    with _routing_lock:
+        _routing_stats['failovers'] += 1
+
+def _get_replica():
+    global _replica
+    if time.monotonic() < _replica_down_until:
+        return None
+    if _replica is None:
+        config = _default_replica_config() if _replica_config is None else _replica_config
+        if not config:
+            return None
+        with _backend_lock:
+            if _replica is None:
+                try:
+                    _replica = create_backend(config[0], readonly=True, **config[1])
+                except Exception:
+                    _mark_replica_down()
+                    return None
+    return _replica
+
+def set_request_user(user_id, read_your_writes_until=None):
+    """Tell readers whose request this thread is serving, and until when (a
+    time.time() deadline kept in the user's session) their reads must see
+    their own writes."""
+    _request_user.id = user_id
+    _request_user.read_your_writes_until = read_your_writes_until
+
+def get_read_your_writes_deadline():
+    """The request user's read-your-writes deadline, extended by any write in
+    this request; the caller stores it in the session for later requests."""
+    return getattr(_request_user, 'read_your_writes_until', None)
+
+def _note_write(*user_ids):
+    # Only the request user's own writes open a window; the deadline goes back
+    # to their session, which is the only place a later request can find it.
+    request_user = getattr(_request_user, 'id', None)
+    if request_user is None or request_user not in user_ids or not _replica_enabled():
+        return
+    _extend_read_your_writes(READ_YOUR_WRITES_WINDOW)
+
+def _extend_read_your_writes(seconds):
+    deadline = time.time() + seconds
+    current = getattr(_request_user, 'read_your_writes_until', None)
+    _request_user.read_your_writes_until = max(current or 0, deadline)
+
+def expect_write(user_id, within):
+    """Open the read-your-writes window now for a write ``user_id`` makes within
+    ``within`` seconds, after the response headers (and so the session) have
+    gone out, e.g. a chat turn saved at the end of a streamed reply."""
+    if getattr(_request_user, 'id', None) != user_id or user_id is None or not _replica_enabled():
+        return
+    _extend_read_your_writes(within + READ_YOUR_WRITES_WINDOW)
+
+def _reads_own_writes(user_id=None):
+    request_user = getattr(_request_user, 'id', None)
+    if request_user is None or (user_id is not None and user_id != request_user):
+        return False
+    deadline = getattr(_request_user, 'read_your_writes_until', None)
+    return deadline is not None and deadline > time.time()
+
+def get_replica_stats():
+    with _routing_lock:
+        stats = dict(_routing_stats)
+    stats['enabled'] = _replica_enabled()
+    stats['down_for'] = max(0.0, _replica_down_until - time.monotonic())
+    if _replica is not None:
+        stats['pool'] = _replica.stats()
+    return stats
+
+def get_pool_stats():
+    backend = get_backend()
+    stats = backend.stats()
+    stats['backend'] = backend.name
+    if _replica_enabled():
+        stats['replica'] = get_replica_stats()
+    return stats
 
 @contextmanager
 def get_db_connection():
-    conn = None
+    backend = get_backend()
+    conn = backend.acquire()
+    _query_stats.connection_acquired()
     try:
-        conn = pyodbc.connect(get_connection_string())
-        conn.autocommit = False
         yield conn
-    except Exception as e:
-        if conn:
-            conn.rollback()
-        raise e
     finally:
-        if conn:
-            conn.close()
+        backend.release(conn)
 
 @contextmanager
-def get_db_cursor():
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
+def _transaction(backend, conn):
+    # Instrumented cursor on an acquired connection, which always goes back to backend.
+    _query_stats.connection_acquired()
+    try:
+        cursor = InstrumentedCursor(conn.cursor(), _query_stats)
         try:
             yield cursor
+            cursor.close()
+            started = time.perf_counter()
             conn.commit()
+            _query_stats.record('COMMIT', time.perf_counter() - started, 0)
         except Exception:
+            cursor.finish()
             conn.rollback()
             raise
+    finally:
+        backend.release(conn)
 
-def init_db():
-    try:
-        with get_db_cursor() as cursor:
-                        
-            cursor.execute('''
-                IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='users' AND xtype='U')
-                CREATE TABLE users (
-                    id INT IDENTITY(1,1) PRIMARY KEY,
-                    first_name NVARCHAR(50) NOT NULL,
-                    last_name NVARCHAR(50) NOT NULL,
-                    email NVARCHAR(100) UNIQUE NOT NULL,
-                    password NVARCHAR(100) NOT NULL,
-                    gender NVARCHAR(10) CHECK(gender IN ('male', 'female')) DEFAULT 'male',
-                    profile_picture NVARCHAR(255) DEFAULT 'default.png',
-                    created_at DATETIME2 DEFAULT GETDATE()
-                )
-            ''')
-            
-            cursor.execute('''
-                IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='posts' AND xtype='U')
-                CREATE TABLE posts (
-                    id INT IDENTITY(1,1) PRIMARY KEY,
-                    content NVARCHAR(MAX) NOT NULL,
-                    author NVARCHAR(100) NOT NULL,
-                    user_id INT NOT NULL,
-                    post_type NVARCHAR(20) CHECK(post_type IN ('inquiry', 'lost_cat', 'advice', 'story', 'help', 'other')) DEFAULT 'other',
-                    post_image NVARCHAR(255),
-                    cluster NVARCHAR(50) DEFAULT 'general',
-                    created_at DATETIME2 DEFAULT GETDATE()
-                )
-            ''')
+@contextmanager
+def get_db_cursor():
+    backend = get_backend()
+    with _transaction(backend, backend.acquire()) as cursor:
+        yield cursor
 
-            cursor.execute('''
-                IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='comments' AND xtype='U')
-                CREATE TABLE comments (
-                    id INT IDENTITY(1,1) PRIMARY KEY,
-                    text NVARCHAR(MAX) NOT NULL,
-                    author NVARCHAR(100) NOT NULL,
-                    user_id INT NOT NULL,
-                    post_id INT NOT NULL,
-                    created_at DATETIME2 DEFAULT GETDATE()
-                )
-            ''')
-            
-            cursor.execute('''
-                IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='reactions' AND xtype='U')
-                CREATE TABLE reactions (
-                    id INT IDENTITY(1,1) PRIMARY KEY,
-                    user_id INT NOT NULL,
-                    post_id INT NOT NULL,
-                    reaction_type NVARCHAR(10) CHECK(reaction_type IN ('like', 'love', 'haha', 'wow', 'sad', 'angry')) DEFAULT 'like',
-                    created_at DATETIME2 DEFAULT GETDATE(),
-                    UNIQUE(user_id, post_id)
-                )
-            ''')
-            
-            cursor.execute('''
-                IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='search_history' AND xtype='U')
-                CREATE TABLE search_history (
-                    id INT IDENTITY(1,1) PRIMARY KEY,
-                    user_id INT,
-                    search_uuid NVARCHAR(36) NOT NULL,
-                    location NVARCHAR(255) NOT NULL,
-                    search_date DATETIME2 DEFAULT GETDATE(),
-                    clinics_found INT DEFAULT 0
-                )
-            ''')
-            
-            cursor.execute('''
-                IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='veterinarians' AND xtype='U')
-                CREATE TABLE veterinarians (
-                    id INT IDENTITY(1,1) PRIMARY KEY,
-                    search_uuid NVARCHAR(36) NOT NULL,
-                    name NVARCHAR(255) NOT NULL,
-                    phone NVARCHAR(50),
-                    address NVARCHAR(MAX),
-                    website NVARCHAR(500),
-                    rating REAL,
-                    reviews INT,
-                    latitude REAL,
-                    longitude REAL,
-                    hours NVARCHAR(MAX),
-                    saved_at DATETIME2 DEFAULT GETDATE()
-                )
-            ''')
-            
-            cursor.execute('''
-                IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='chat_history' AND xtype='U')
-                CREATE TABLE chat_history (
-                    id INT IDENTITY(1,1) PRIMARY KEY,
-                    user_id INT NOT NULL,
-                    message NVARCHAR(MAX) NOT NULL,
-                    response NVARCHAR(MAX) NOT NULL,
-                    is_user_message BIT NOT NULL,
-                    session_id NVARCHAR(100) NOT NULL,
-                    created_at DATETIME2 DEFAULT GETDATE()
-                )
-            ''')
-            
-            try:
-                cursor.execute('''
-                    IF NOT EXISTS (
-                        SELECT * FROM sys.foreign_keys 
-                        WHERE name = 'FK_posts_user_id'
-                    )
-                    ALTER TABLE posts 
-                    ADD CONSTRAINT FK_posts_user_id 
-                    FOREIGN KEY (user_id) REFERENCES users(id)
-                ''')
-            except Exception:
-                pass
-            
-            try:
-                cursor.execute('''
-                    IF NOT EXISTS (
-                        SELECT * FROM sys.foreign_keys 
-                        WHERE name = 'FK_comments_user_id'
-                    )
-                    ALTER TABLE comments 
-                    ADD CONSTRAINT FK_comments_user_id 
-                    FOREIGN KEY (user_id) REFERENCES users(id)
-                ''')
-            except Exception:
-                pass
-            
-            try:
-                cursor.execute('''
-                    IF NOT EXISTS (
-                        SELECT * FROM sys.foreign_keys 
-                        WHERE name = 'FK_comments_post_id'
-                    )
-                    ALTER TABLE comments 
-                    ADD CONSTRAINT FK_comments_post_id 
-                    FOREIGN KEY (post_id) REFERENCES posts(id)
-                ''')
-            except Exception:
-                pass
-            
-            try:
-                cursor.execute('''
-                    IF NOT EXISTS (
-                        SELECT * FROM sys.foreign_keys 
-                        WHERE name = 'FK_reactions_user_id'
-                    )
-                    ALTER TABLE reactions 
-                    ADD CONSTRAINT FK_reactions_user_id 
-                    FOREIGN KEY (user_id) REFERENCES users(id)
-                ''')
-            except Exception:
-                pass
-            
-            try:
-                cursor.execute('''
-                    IF NOT EXISTS (
-                        SELECT * FROM sys.foreign_keys 
-                        WHERE name = 'FK_reactions_post_id'
-                    )
-                    ALTER TABLE reactions 
-                    ADD CONSTRAINT FK_reactions_post_id 
-                    FOREIGN KEY (post_id) REFERENCES posts(id)
-                ''')
-            except Exception:
-                pass
-            
-            try:
-                cursor.execute('''
-                    IF NOT EXISTS (
-                        SELECT * FROM sys.foreign_keys 
-                        WHERE name = 'FK_search_history_user_id'
-                    )
-                    ALTER TABLE search_history 
-                    ADD CONSTRAINT FK_search_history_user_id 
-                    FOREIGN KEY (user_id) REFERENCES users(id)
-                ''')
-            except Exception:
-                pass
-            
-            try:
-                cursor.execute('''
-                    IF NOT EXISTS (
-                        SELECT * FROM sys.foreign_keys 
-                        WHERE name = 'FK_chat_history_user_id'
-                    )
-                    ALTER TABLE chat_history 
-                    ADD CONSTRAINT FK_chat_history_user_id 
-                    FOREIGN KEY (user_id) REFERENCES users(id)
-                ''')
-            except Exception:
-                pass
-            
-            indexes = [
-                ('IX_users_email', 'users(email)'),
-                ('IX_posts_user_id', 'posts(user_id)'),
-                ('IX_posts_cluster', 'posts(cluster)'),
-                ('IX_comments_post_id', 'comments(post_id)'),
-                ('IX_reactions_post_id', 'reactions(post_id)'),
-                ('IX_search_history_user_id', 'search_history(user_id)'),
-                ('IX_chat_history_user_id', 'chat_history(user_id)')
-            ]
-            
-            for index_name, index_definition in indexes:
-                try:
-                    cursor.execute(f'''
-                        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='{index_name}')
-                        CREATE INDEX {index_name} ON {index_definition}
-                    ''')
-                except Exception:
-                    pass
-            
-            cursor.execute("SELECT id FROM users WHERE email = 'demo@example.com'")
-            if not cursor.fetchone():
-                demo_password = hash_password('password123')
-                cursor.execute(
-                    "INSERT INTO users (first_name, last_name, email, password, gender, profile_picture) OUTPUT INSERTED.id VALUES (?, ?, ?, ?, ?, ?)",
-                    ('Demo', 'User', 'demo@example.com', demo_password, 'male', 'male.png')
-                )
-            
-    except Exception as e:
+def _acquire_reader(user_id):
+    replica = None if _reads_own_writes(user_id) else _get_replica()
+    if replica is not None:
+        try:
+            conn = replica.acquire()
+            with _routing_lock:
+                _routing_stats['replica_reads'] += 1
+            return replica, conn
+        except Exception:
+            _mark_replica_down()
+    backend = get_backend()
+    conn = backend.acquire()
+    with _routing_lock:
+        _routing_stats['primary_reads'] += 1
+    return backend, conn
+
+class _ReplicaCursor:
+    """Read cursor on the replica that moves to the primary on a driver error.
+
+    The failing statement is run again on the primary, unless some of its rows
+    were already fetched; the rest of the block then stays on the primary.
+    """
+
+    def __init__(self, replica, conn):
+        self._replica = replica
+        self._context = _transaction(replica, conn)
+        self._cursor = self._context.__enter__()
+        self._on_replica = True
+        self._statement = None
+        self._fetched = False
+
+    def _fail_over(self, error):
+        _mark_replica_down()
+        self._on_replica = False
+        try:
+            self._context.__exit__(type(error), error, error.__traceback__)
+        except Exception:
+            pass
+        backend = get_backend()
+        self._context = _transaction(backend, backend.acquire())
+        with _routing_lock:
+            _routing_stats['primary_reads'] += 1
+        self._cursor = self._context.__enter__()
+
+    def execute(self, sql, *args):
+        self._statement = (sql, args)
+        self._fetched = False
+        try:
+            return self._cursor.execute(sql, *args)
+        except self._replica.Error as e:
+            if not self._on_replica:
+                raise
+            self._fail_over(e)
+        return self._cursor.execute(sql, *args)
+
+    def _fetch(self, method, *args):
+        try:
+            rows = getattr(self._cursor, method)(*args)
+        except self._replica.Error as e:
+            if not self._on_replica or self._fetched or self._statement is None:
+                raise
+            self._fail_over(e)
+            sql, statement_args = self._statement
+            self._cursor.execute(sql, *statement_args)
+            rows = getattr(self._cursor, method)(*args)
+        self._fetched = True
+        return rows
+
+    def fetchone(self):
+        return self._fetch('fetchone')
+
+    def fetchmany(self, *args):
+        return self._fetch('fetchmany', *args)
+
+    def fetchall(self):
+        return self._fetch('fetchall')
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def close(self, error=None):
+        if error is None:
+            self._context.__exit__(None, None, None)
+        else:
+            self._context.__exit__(type(error), error, error.__traceback__)
+
+@contextmanager
+def get_read_cursor(user_id=None):
+    """Cursor for pure reads. Uses the replica when one is configured and healthy,
+    unless ``user_id`` (default: the request user) wrote within READ_YOUR_WRITES_WINDOW.
+    A replica that cannot hand out a connection or fails a statement is skipped for
+    REPLICA_RETRY_AFTER, and the statement is retried once on the primary."""
+    backend, conn = _acquire_reader(user_id)
+    if backend is get_backend():
+        with _transaction(backend, conn) as cursor:
+            yield cursor
+        return
+    try:
+        cursor = _ReplicaCursor(backend, conn)
+    except backend.Error:
+        _mark_replica_down()
+        backend = get_backend()
+        with _transaction(backend, backend.acquire()) as cursor:
+            yield cursor
+        return
+    try:
+        yield cursor
+    except BaseException as e:
+        cursor.close(e)
         raise
+    cursor.close()
+
+def begin_request_stats(label=None):
+    """Start counting statements, connections and DB time for this thread's request."""
+    _query_stats.begin_request(label)
+
+def end_request_stats():
+    return _query_stats.end_request()
+
+def get_query_stats(top=20, order_by='total_ms'):
+    """Per-fingerprint calls, rows and p50/p95/p99 latency, slowest total first."""
+    return _query_stats.snapshot(top, order_by)
+
+def get_slow_queries(limit=50):
+    return _query_stats.slow_queries(limit)
+
+def set_slow_query_threshold(milliseconds):
+    """None turns the slow-query log off."""
+    _query_stats.slow_query_ms = milliseconds
+
+def reset_query_stats():
+    _query_stats.reset()
+
+_USER_COLUMNS = ('first_name', 'last_name', 'email', 'password', 'gender', 'profile_picture')
+
+def init_db():
+    """Bring the schema up to date; an already-current database costs one query."""
+    return migrations.migrate(get_db_cursor, get_backend())
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
@@ -279,51 +425,74 @@ def create_user(first_name, last_name, email, password, gender='male', profile_p
             
             hashed_pw = hash_password(password)
             cursor.execute(
-                "INSERT INTO users (first_name, last_name, email, password, gender, profile_picture) OUTPUT INSERTED.id VALUES (?, ?, ?, ?, ?, ?)",
+                get_backend().insert_sql('users', _USER_COLUMNS),
                 (first_name, last_name, email, hashed_pw, gender, profile_picture)
             )
             user_id = cursor.fetchone()[0]
-            return user_id
-        except pyodbc.IntegrityError:
+        except get_backend().IntegrityError:
             raise ValueError("Email already registered")
         except Exception as e:
             raise e
+    # After the commit, so a concurrent lookup cannot cache the pre-signup state
+    _user_cache.invalidate(('email', email), ('id', user_id))
+    return user_id
+
+_USER_SQL = "SELECT id, first_name, last_name, email, password, gender, profile_picture FROM users"
+
+def _user_dict(row):
+    return {
+        'id': row[0],
+        'first_name': row[1],
+        'last_name': row[2],
+        'email': row[3],
+        'password': row[4],
+        'gender': row[5],
+        'profile_picture': row[6]
+    }
+
+def _user_tags(user):
+    return (f"user:{user['id']}",)
+
+def _cached_user(key, column, value):
+    # Users are read from the primary so a new profile picture is never cached
+    # from a lagging replica. Misses are not cached: a user who signs up on
+    # another worker must be found by the next login here.
+    def load(keys):
+        with get_db_cursor() as cursor:
+            cursor.execute(f"{_USER_SQL} WHERE {column} = ?", (value,))
+            row = cursor.fetchone()
+        return {key: _user_dict(row)} if row else {}
+    return _user_cache.get_or_load_many([key], load, _user_tags).get(key)
 
 def get_user_by_email(email):
-    with get_db_cursor() as cursor:
-        cursor.execute(
-            "SELECT id, first_name, last_name, password, gender, profile_picture FROM users WHERE email = ?", 
-            (email,)
-        )
-        row = cursor.fetchone()
-        if row:
-            return {
-                'id': row[0],
-                'first_name': row[1],
-                'last_name': row[2],
-                'password': row[3],
-                'gender': row[4],
-                'profile_picture': row[5]
-            }
-        return None
+    user = _cached_user(('email', email), 'email', email)
+    if user:
+        return {column: user[column] for column in ('id', 'first_name', 'last_name', 'password', 'gender', 'profile_picture')}
+    return None
 
 def get_user_by_id(user_id):
+    user = _cached_user(('id', user_id), 'id', user_id)
+    if user:
+        return {column: user[column] for column in ('id', 'first_name', 'last_name', 'email', 'gender', 'profile_picture')}
+    return None
+
+def _load_users(keys):
+    users = {}
     with get_db_cursor() as cursor:
-        cursor.execute(
-            "SELECT id, first_name, last_name, email, gender, profile_picture FROM users WHERE id = ?", 
-            (user_id,)
-        )
-        row = cursor.fetchone()
-        if row:
-            return {
-                'id': row[0],
-                'first_name': row[1],
-                'last_name': row[2],
-                'email': row[3],
-                'gender': row[4],
-                'profile_picture': row[5]
-            }
-        return None
+        for batch in _chunks([user_id for _, user_id in keys]):
+            cursor.execute(f"{_USER_SQL} WHERE id IN ({', '.join('?' * len(batch))})", batch)
+            for row in cursor.fetchall():
+                users[('id', row[0])] = _user_dict(row)
+    return users
+
+def get_user_pictures(user_ids):
+    """Profile picture per user id, from the user cache with one query per batch of misses."""
+    keys = [('id', user_id) for user_id in set(user_ids) if user_id is not None]
+    users = _user_cache.get_or_load_many(keys, _load_users, _user_tags)
+    return {key[1]: user['profile_picture'] for key, user in users.items()}
+
+def get_user_cache_stats():
+    return _user_cache.stats()
 
 def update_user_profile_picture(user_id, profile_picture):
     with get_db_cursor() as cursor:
@@ -332,227 +501,442 @@ def update_user_profile_picture(user_id, profile_picture):
                 "UPDATE users SET profile_picture = ? WHERE id = ?",
                 (profile_picture, user_id)
             )
-            return True
+            _note_write(user_id)
         except Exception as e:
             return False
+    _user_cache.invalidate_tags(f"user:{user_id}")
+    return True
 
-def get_all_posts():
-    with get_db_cursor() as cursor:
-        cursor.execute('''
-            SELECT p.id, p.content, p.author, p.user_id, p.post_type, p.post_image, p.cluster, p.created_at, 
-                   u.profile_picture as author_picture
-            FROM posts p
-            LEFT JOIN users u ON p.user_id = u.id
-            ORDER BY p.created_at DESC
-        ''')
-        posts = cursor.fetchall()
+FEED_BATCH_SIZE = 1000
+FEED_PAGE_SIZE = 20
+FEED_MAX_PAGE_SIZE = 100
+# Latest comments embedded per feed post; the rest load through get_comments_for_post()
+FEED_COMMENT_PREVIEW = 3
+# SQLite allows at most 500 SELECTs in one UNION ALL
+FEED_PREVIEW_BATCH_SIZE = 100
+COMMENT_PAGE_SIZE = 20
+COMMENT_MAX_PAGE_SIZE = 100
+
+_FEED_POSTS_SQL = '''
+    SELECT p.id, p.content, p.author, p.user_id, p.post_type, p.post_image, p.cluster, p.created_at
+    FROM posts p
+'''
+
+def _chunks(items, size=FEED_BATCH_SIZE):
+    # SQL Server caps a single statement at 2100 parameters
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _comment_dict(comment):
+    # (id, text, author, user_id, created_at); author_picture comes from the user cache
+    return {
+        'id': comment[0],
+        'text': comment[1],
+        'author': comment[2],
+        'user_id': comment[3],
+        'created_at': comment[4]
+    }
+
+def _with_comment_pictures(comments, pictures):
+    return [dict(comment, author_picture=pictures.get(comment['user_id'])) for comment in comments]
+
+def _with_author_pictures(posts):
+    """Copies of feed posts and their comments with author_picture filled in.
+
+    Pictures are resolved on every call instead of being stored in cached feed
+    pages, so a profile picture change shows up without invalidating the feed.
+    """
+    user_ids = [post['user_id'] for post in posts]
+    for post in posts:
+        user_ids.extend(comment['user_id'] for comment in post['comments'])
+    pictures = get_user_pictures(user_ids)
+    return [dict(
+        post,
+        author_picture=pictures.get(post['user_id']),
+        comments=_with_comment_pictures(post['comments'], pictures)
+    ) for post in posts]
+
+def _load_feed(cursor, posts):
+    """Attach reactions, comment counts and the latest FEED_COMMENT_PREVIEW comments
+    to a page of post rows in three queries per batch."""
+    post_ids = [post[0] for post in posts]
+    reactions_by_post = {post_id: {} for post_id in post_ids}
+    comments_by_post = {post_id: [] for post_id in post_ids}
+    comment_counts = {}
+    
+    for batch in _chunks(post_ids):
+        placeholders = ', '.join('?' * len(batch))
         
-        posts_data = []
-        for post in posts:
-            cursor.execute('''
-                SELECT reaction_type, COUNT(*) as count 
-                FROM reactions 
-                WHERE post_id = ? 
-                GROUP BY reaction_type
-            ''', (post[0],))
-            reactions_data = cursor.fetchall()
-            
-            cursor.execute('''
-                SELECT COUNT(*) as total_reactions 
-                FROM reactions 
-                WHERE post_id = ?
-            ''', (post[0],))
-            total_reactions = cursor.fetchone()[0]
-            
-            cursor.execute('''
-                SELECT c.text, c.author, c.user_id, u.profile_picture as author_picture, c.created_at 
-                FROM comments c 
-                LEFT JOIN users u ON c.user_id = u.id
-                WHERE c.post_id = ? 
-                ORDER BY c.created_at ASC
-            ''', (post[0],))
-            comments = cursor.fetchall()
-            
-            reactions = {}
-            for reaction in reactions_data:
-                reactions[reaction[0]] = reaction[1]
-            
-            posts_data.append({
-                'id': post[0],
-                'content': post[1],
-                'author': post[2],
-                'user_id': post[3],
-                'author_picture': post[8],
-                'post_type': post[4],
-                'post_image': post[5],
-                'cluster': post[6],
-                'created_at': post[7],
-                'reactions': reactions,
-                'total_reactions': total_reactions,
-                'comments': [{
-                    'text': comment[0],
-                    'author': comment[1],
-                    'user_id': comment[2],
-                    'author_picture': comment[3],
-                    'created_at': comment[4]
-                } for comment in comments]
-            })
+        cursor.execute(f'''
+            SELECT post_id, reaction_type, reaction_count 
+            FROM post_reaction_counts 
+            WHERE post_id IN ({placeholders}) AND reaction_count > 0
+        ''', batch)
+        for post_id, reaction_type, count in cursor.fetchall():
+            reactions_by_post[post_id][reaction_type] = count
+        
+        cursor.execute(f'''
+            SELECT post_id, COUNT(*)
+            FROM comments
+            WHERE post_id IN ({placeholders})
+            GROUP BY post_id
+        ''', batch)
+        comment_counts.update(cursor.fetchall())
         
-        return posts_data
+        # One index seek per post: a window over the IN list would rank every
+        # comment of a viral post just to keep its latest few.
+        commented = [post_id for post_id in batch if comment_counts.get(post_id)]
+        for previews in _chunks(commented, FEED_PREVIEW_BATCH_SIZE):
+            cursor.execute(' UNION ALL '.join([f'''
+                SELECT * FROM (
+                    SELECT c.post_id, c.id, c.text, c.author, c.user_id, c.created_at
+                    FROM comments c
+                    WHERE c.post_id = ?
+                    ORDER BY c.created_at DESC, c.id DESC
+                    {get_backend().limit_clause}
+                ) latest{index}''' for index in range(len(previews))]),
+                [value for post_id in previews for value in (post_id, FEED_COMMENT_PREVIEW)]
+            )
+            for comment in cursor.fetchall():
+                comments_by_post[comment[0]].append(_comment_dict(comment[1:]))
+    for comments in comments_by_post.values():
+        comments.sort(key=lambda comment: (comment['created_at'], comment['id']))
+    
+    posts_data = []
+    for post in posts:
+        reactions = reactions_by_post[post[0]]
+        posts_data.append({
+            'id': post[0],
+            'content': post[1],
+            'author': post[2],
+            'user_id': post[3],
+            'post_type': post[4],
+            'post_image': post[5],
+            'cluster': post[6],
+            'created_at': post[7],
+            'reactions': reactions,
+            'total_reactions': sum(reactions.values()),
+            'comments': comments_by_post[post[0]],
+            'comment_count': comment_counts.get(post[0], 0),
+            'comments_cursor': get_next_comment_cursor(
+                comments_by_post[post[0]], comment_counts.get(post[0], 0) > FEED_COMMENT_PREVIEW
+            )
+        })
+    
+    return posts_data
+
+def feed_page_size(limit=None):
+    if limit is None:
+        return FEED_PAGE_SIZE
+    return max(1, min(int(limit), FEED_MAX_PAGE_SIZE))
+
+def encode_feed_cursor(created_at, post_id):
+    token = f"{created_at.isoformat()}|{post_id}"
+    return base64.urlsafe_b64encode(token.encode()).decode().rstrip('=')
+
+def decode_feed_cursor(cursor_token):
+    try:
+        padded = cursor_token + '=' * (-len(cursor_token) % 4)
+        created_at, post_id = base64.urlsafe_b64decode(padded.encode()).decode().rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(post_id)
+    except Exception:
+        raise ValueError("Invalid feed cursor")
+
+def get_next_feed_cursor(posts, limit=None):
+    """Cursor for the page after ``posts``, or None when the page was not full."""
+    if not posts or len(posts) < feed_page_size(limit):
+        return None
+    last_post = posts[-1]
+    return encode_feed_cursor(last_post['created_at'], last_post['id'])
+
+def _get_feed_page(cursor, conditions, params, limit, before):
+    conditions = list(conditions)
+    params = list(params)
+    if before:
+        created_at, post_id = decode_feed_cursor(before)
+        # Drivers may truncate DATETIME2 to microseconds, so treat anything within
+        # the same microsecond as a tie and let the id break it.
+        conditions.append('p.created_at < ? AND (p.created_at < ? OR p.id < ?)')
+        params.extend([created_at + timedelta(microseconds=1), created_at, post_id])
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    cursor.execute(_FEED_POSTS_SQL + f'''
+        {where}
+        ORDER BY p.created_at DESC, p.id DESC
+        {get_backend().limit_clause}
+    ''', params + [feed_page_size(limit)])
+    return _load_feed(cursor, cursor.fetchall())
+
+def _feed_tags(cluster, before):
+    def tags(posts):
+        # Keyset pages after a cursor never gain new posts, so only first pages
+        # depend on create_post; every page depends on the posts it shows.
+        page_tags = {f'post:{post["id"]}' for post in posts}
+        if not before:
+            page_tags.add(f'feed-head:{cluster}')
+        return page_tags
+    return tags
+
+def _invalidate_feed(cluster=None, post_id=None, cluster_stats=False):
+    tags = []
+    if cluster is not None:
+        tags.extend(['feed-head:*', f'feed-head:{cluster}', 'clusters'])
+    if post_id is not None:
+        tags.append(f'post:{post_id}')
+    if cluster_stats:
+        tags.append('clusters')
+    _feed_cache.invalidate_tags(*tags)
+
+def get_feed_cache_stats():
+    return _feed_cache.stats()
+
+def clear_feed_cache():
+    _feed_cache.clear()
+
+def clear_user_cache():
+    _user_cache.clear()
+
+def _cached_read(key, load, tags):
+    # Inside a read-your-writes window the cache is skipped: its pages may have
+    # been filled from a replica that has not caught up with this user's write.
+    if _reads_own_writes():
+        return load()
+    return _feed_cache.get_or_load(key, load, tags)
+
+def get_all_posts(limit=FEED_PAGE_SIZE, before=None):
+    def load():
+        with get_read_cursor() as cursor:
+            return _get_feed_page(cursor, [], [], limit, before)
+    key = ('posts', '*', feed_page_size(limit), before)
+    return _with_author_pictures(_cached_read(key, load, _feed_tags('*', before)))
 
 def create_post(content, author, user_id, post_type='other', post_image=None, cluster='general'):
     with get_db_cursor() as cursor:
         cursor.execute(
-            "INSERT INTO posts (content, author, user_id, post_type, post_image, cluster) OUTPUT INSERTED.id VALUES (?, ?, ?, ?, ?, ?)",
+            get_backend().insert_sql('posts', ('content', 'author', 'user_id', 'post_type', 'post_image', 'cluster')),
             (content, author, user_id, post_type, post_image, cluster)
         )
         post_id = cursor.fetchone()[0]
-        return post_id
+        _index_text(cursor, post_id, content, new_post=True)
+        _count_cluster_activity(cursor, cluster, posts=1)
+    _note_write(user_id)
+    _invalidate_feed(cluster=cluster)
+    return post_id
+
+def get_posts_by_cluster(cluster, limit=FEED_PAGE_SIZE, before=None):
+    def load():
+        with get_read_cursor() as cursor:
+            return _get_feed_page(cursor, ['p.cluster = ?'], [cluster], limit, before)
+    key = ('posts', cluster, feed_page_size(limit), before)
+    return _with_author_pictures(_cached_read(key, load, _feed_tags(cluster, before)))
 
-def get_posts_by_cluster(cluster):
+TRENDING_DAYS = 7
+TRENDING_LIMIT = 5
+
+def _count_cluster_activity(cursor, cluster, posts=0, comments=0):
+    """Bump cluster_stats and today's cluster_activity row in the caller's transaction."""
+    if cluster is None:
+        return
+    backend = get_backend()
+    updates = {
+        'post_count': 'cluster_stats.post_count + excluded.post_count',
+        'comment_count': 'cluster_stats.comment_count + excluded.comment_count'
+    }
+    if posts:
+        updates['last_post_at'] = 'excluded.last_post_at'
+    cursor.execute(backend.upsert_sql(
+        'cluster_stats',
+        ('cluster',),
+        {'post_count': '?', 'comment_count': '?', 'last_post_at': 'CURRENT_TIMESTAMP' if posts else 'NULL'},
+        updates
+    ), (cluster, posts, comments))
+    cursor.execute(backend.upsert_sql(
+        'cluster_activity',
+        ('cluster',),
+        {'activity_date': backend.current_date, 'post_count': '?', 'comment_count': '?'},
+        {
+            'post_count': 'cluster_activity.post_count + excluded.post_count',
+            'comment_count': 'cluster_activity.comment_count + excluded.comment_count'
+        },
+        value_keys=('activity_date',)
+    ), (cluster, posts, comments))
+
+def rebuild_cluster_stats():
+    """Recount cluster_stats and cluster_activity from posts and comments."""
     with get_db_cursor() as cursor:
-        cursor.execute('''
-            SELECT p.id, p.content, p.author, p.user_id, p.post_type, p.post_image, p.cluster, p.created_at, 
-                   u.profile_picture as author_picture
-            FROM posts p
-            LEFT JOIN users u ON p.user_id = u.id
-            WHERE p.cluster = ?
-            ORDER BY p.created_at DESC
-        ''', (cluster,))
-        posts = cursor.fetchall()
-        
-        posts_data = []
-        for post in posts:
-            cursor.execute('''
-                SELECT reaction_type, COUNT(*) as count 
-                FROM reactions 
-                WHERE post_id = ? 
-                GROUP BY reaction_type
-            ''', (post[0],))
-            reactions_data = cursor.fetchall()
-            
-            cursor.execute('''
-                SELECT COUNT(*) as total_reactions 
-                FROM reactions 
-                WHERE post_id = ?
-            ''', (post[0],))
-            total_reactions = cursor.fetchone()[0]
-            
+        for statement in migrations.CLUSTER_STATS_REBUILD[get_backend().name]:
+            cursor.execute(statement)
+    _invalidate_feed(cluster_stats=True)
+
+def rebuild_counters():
+    """Recount post_reaction_counts and chat_sessions from reactions and chat_history."""
+    with get_db_cursor() as cursor:
+        for statement in migrations.COUNTERS_REBUILD:
+            cursor.execute(statement)
+    clear_feed_cache()
+
+def get_all_clusters():
+    def load():
+        with get_read_cursor() as cursor:
             cursor.execute('''
-                SELECT c.text, c.author, c.user_id, u.profile_picture as author_picture, c.created_at 
-                FROM comments c 
-                LEFT JOIN users u ON c.user_id = u.id
-                WHERE c.post_id = ? 
-                ORDER BY c.created_at ASC
-            ''', (post[0],))
-            comments = cursor.fetchall()
+                SELECT cluster, post_count, comment_count, last_post_at
+                FROM cluster_stats
+                WHERE post_count > 0
+                ORDER BY post_count DESC
+            ''')
             
-            reactions = {}
-            for reaction in reactions_data:
-                reactions[reaction[0]] = reaction[1]
+            clusters = cursor.fetchall()
+            return [{
+                'cluster': cluster[0],
+                'post_count': cluster[1],
+                'comment_count': cluster[2],
+                'last_post_at': cluster[3]
+            } for cluster in clusters]
+    return _cached_read(('clusters',), load, ['clusters'])
+
+def get_trending_clusters(days=TRENDING_DAYS, limit=TRENDING_LIMIT, today=None):
+    """Clusters with the most posts and comments over the ``days`` days up to
+    ``today``, which defaults to the database's current date."""
+    def load():
+        with get_read_cursor() as cursor:
+            end = today
+            if end is None:
+                cursor.execute(f'SELECT {get_backend().current_date}')
+                end = cursor.fetchone()[0]
+                if isinstance(end, str):
+                    end = datetime.fromisoformat(end)
+            since = end - timedelta(days=days - 1)
+            cursor.execute(f'''
+                SELECT cluster, SUM(post_count) AS posts, SUM(comment_count) AS comments
+                FROM cluster_activity
+                WHERE activity_date >= ?
+                GROUP BY cluster
+                ORDER BY SUM(post_count) * 2 + SUM(comment_count) DESC, cluster
+                {get_backend().limit_clause}
+            ''', (since.strftime('%Y-%m-%d'), limit))
             
-            posts_data.append({
-                'id': post[0],
-                'content': post[1],
-                'author': post[2],
-                'user_id': post[3],
-                'author_picture': post[8],
-                'post_type': post[4],
-                'post_image': post[5],
-                'cluster': post[6],
-                'created_at': post[7],
-                'reactions': reactions,
-                'total_reactions': total_reactions,
-                'comments': [{
-                    'text': comment[0],
-                    'author': comment[1],
-                    'user_id': comment[2],
-                    'author_picture': comment[3],
-                    'created_at': comment[4]
-                } for comment in comments]
-            })
-        
-        return posts_data
+            return [{
+                'cluster': row[0],
+                'recent_posts': row[1],
+                'recent_comments': row[2]
+            } for row in cursor.fetchall()]
+    return _cached_read(('trending', days, limit, today), load, ['clusters'])
 
-def get_all_clusters():
-    with get_db_cursor() as cursor:
+# One batch: the UPDLOCK/HOLDLOCK read serializes concurrent clicks on the same
+# (user_id, post_id) key, and the counters change in the same transaction.
+_TOGGLE_REACTION_SQL = '''
+    SET NOCOUNT ON;
+    DECLARE @user_id INT = ?, @post_id INT = ?, @reaction_type NVARCHAR(10) = ?;
+    DECLARE @previous NVARCHAR(10), @action NVARCHAR(10);
+    
+    SELECT @previous = reaction_type
+    FROM reactions WITH (UPDLOCK, HOLDLOCK)
+    WHERE user_id = @user_id AND post_id = @post_id;
+    
+    IF @previous IS NULL
+    BEGIN
+        INSERT INTO reactions (user_id, post_id, reaction_type) VALUES (@user_id, @post_id, @reaction_type);
+        SET @action = 'added';
+    END
+    ELSE IF @previous = @reaction_type
+    BEGIN
+        DELETE FROM reactions WHERE user_id = @user_id AND post_id = @post_id;
+        SET @action = 'removed';
+    END
+    ELSE
+    BEGIN
+        UPDATE reactions SET reaction_type = @reaction_type WHERE user_id = @user_id AND post_id = @post_id;
+        SET @action = 'updated';
+    END
+    
+    IF @previous IS NOT NULL
+        UPDATE post_reaction_counts SET reaction_count = reaction_count - 1
+        WHERE post_id = @post_id AND reaction_type = @previous;
+    
+    IF @action <> 'removed'
+    BEGIN
+        UPDATE post_reaction_counts WITH (UPDLOCK, HOLDLOCK) SET reaction_count = reaction_count + 1
+        WHERE post_id = @post_id AND reaction_type = @reaction_type;
+        IF @@ROWCOUNT = 0
+            INSERT INTO post_reaction_counts (post_id, reaction_type, reaction_count) VALUES (@post_id, @reaction_type, 1);
+    END
+    
+    -- NOCOUNT is a session setting and pooled connections are reused as they
+    -- are, so it is switched back before anything else can see it
+    SET NOCOUNT OFF;
+    SELECT a.action, a.user_reaction, c.reaction_type, c.reaction_count
+    FROM (
+        SELECT @action AS action,
+               CASE WHEN @action = 'removed' THEN NULL ELSE @reaction_type END AS user_reaction
+    ) a
+    LEFT JOIN post_reaction_counts c ON c.post_id = @post_id AND c.reaction_count > 0;
+'''
+
+def _toggle_reaction_sqlite(cursor, user_id, post_id, reaction_type):
+    # Starting with a write takes SQLite's write lock, so the read below cannot go stale.
+    cursor.execute(
+        "DELETE FROM reactions WHERE user_id = ? AND post_id = ? AND reaction_type = ? RETURNING reaction_type",
+        (user_id, post_id, reaction_type)
+    )
+    if cursor.fetchall():
+        previous, action = reaction_type, 'removed'
+    else:
+        cursor.execute(
+            "SELECT reaction_type FROM reactions WHERE user_id = ? AND post_id = ?",
+            (user_id, post_id)
+        )
+        row = cursor.fetchone()
+        previous = row[0] if row else None
+        action = 'updated' if previous else 'added'
         cursor.execute('''
-            SELECT DISTINCT cluster, COUNT(*) as post_count
-            FROM posts 
-            GROUP BY cluster
-            ORDER BY post_count DESC
-        ''')
-        
-        clusters = cursor.fetchall()
-        return [{'cluster': cluster[0], 'post_count': cluster[1]} for cluster in clusters]
+            INSERT INTO reactions (user_id, post_id, reaction_type) VALUES (?, ?, ?)
+            ON CONFLICT (user_id, post_id) DO UPDATE SET reaction_type = excluded.reaction_type
+        ''', (user_id, post_id, reaction_type))
+    
+    if previous:
+        cursor.execute(
+            "UPDATE post_reaction_counts SET reaction_count = reaction_count - 1 WHERE post_id = ? AND reaction_type = ?",
+            (post_id, previous)
+        )
+    if action != 'removed':
+        cursor.execute('''
+            INSERT INTO post_reaction_counts (post_id, reaction_type, reaction_count) VALUES (?, ?, 1)
+            ON CONFLICT (post_id, reaction_type) DO UPDATE SET reaction_count = reaction_count + 1
+        ''', (post_id, reaction_type))
+    
+    cursor.execute(
+        "SELECT reaction_type, reaction_count FROM post_reaction_counts WHERE post_id = ? AND reaction_count > 0",
+        (post_id,)
+    )
+    user_reaction = None if action == 'removed' else reaction_type
+    rows = cursor.fetchall() or [(None, None)]
+    return [(action, user_reaction, row[0], row[1]) for row in rows]
 
 def toggle_reaction(user_id, post_id, reaction_type='like'):
     with get_db_cursor() as cursor:
-        try:
-            cursor.execute(
-                "SELECT id, reaction_type FROM reactions WHERE user_id = ? AND post_id = ?",
-                (user_id, post_id)
-            )
-            existing_reaction = cursor.fetchone()
-            
-            if existing_reaction:
-                if existing_reaction[1] == reaction_type:
-                    cursor.execute(
-                        "DELETE FROM reactions WHERE user_id = ? AND post_id = ?",
-                        (user_id, post_id)
-                    )
-                    action = 'removed'
-                else:
-                    cursor.execute(
-                        "UPDATE reactions SET reaction_type = ? WHERE user_id = ? AND post_id = ?",
-                        (reaction_type, user_id, post_id)
-                    )
-                    action = 'updated'
-            else:
-                cursor.execute(
-                    "INSERT INTO reactions (user_id, post_id, reaction_type) VALUES (?, ?, ?)",
-                    (user_id, post_id, reaction_type)
-                )
-                action = 'added'
-            
-            cursor.execute('''
-                SELECT reaction_type, COUNT(*) as count 
-                FROM reactions 
-                WHERE post_id = ? 
-                GROUP BY reaction_type
-            ''', (post_id,))
-            reactions_data = cursor.fetchall()
-            
-            cursor.execute('''
-                SELECT COUNT(*) as total_reactions 
-                FROM reactions 
-                WHERE post_id = ?
-            ''', (post_id,))
-            total_reactions = cursor.fetchone()[0]
-            
-            cursor.execute(
-                "SELECT reaction_type FROM reactions WHERE user_id = ? AND post_id = ?",
-                (user_id, post_id)
-            )
-            user_reaction_row = cursor.fetchone()
-            user_reaction = user_reaction_row[0] if user_reaction_row else None
-            
-            reactions = {}
-            for reaction in reactions_data:
-                reactions[reaction[0]] = reaction[1]
-            
-            return {
-                'reactions': reactions,
-                'total_reactions': total_reactions,
-                'user_reaction': user_reaction,
-                'action': action
-            }
-                
-        except Exception as e:
-            raise e
+        if get_backend().name == 'sqlite':
+            rows = _toggle_reaction_sqlite(cursor, user_id, post_id, reaction_type)
+        else:
+            cursor.execute(_TOGGLE_REACTION_SQL, (user_id, post_id, reaction_type))
+            rows = cursor.fetchall()
+        
+    _note_write(user_id)
+    _invalidate_feed(post_id=post_id)
+    
+    reactions = {}
+    for row in rows:
+        if row[2] is not None:
+            reactions[row[2]] = row[3]
+    
+    return {
+        'reactions': reactions,
+        'total_reactions': sum(reactions.values()),
+        'user_reaction': rows[0][1],
+        'action': rows[0][0]
+    }
 
 def get_user_reaction(user_id, post_id):
-    with get_db_cursor() as cursor:
+    with get_read_cursor(user_id) as cursor:
         cursor.execute(
             "SELECT reaction_type FROM reactions WHERE user_id = ? AND post_id = ?",
             (user_id, post_id)
@@ -562,80 +946,367 @@ def get_user_reaction(user_id, post_id):
 
 def create_comment(text, author, user_id, post_id):
     with get_db_cursor() as cursor:
-        cursor.execute("SELECT id FROM posts WHERE id = ?", (post_id,))
-        if not cursor.fetchone():
+        cursor.execute("SELECT cluster FROM posts WHERE id = ?", (post_id,))
+        post = cursor.fetchone()
+        if not post:
             raise ValueError("Post not found")
         
         cursor.execute(
             "INSERT INTO comments (text, author, user_id, post_id) VALUES (?, ?, ?, ?)",
             (text, author, user_id, post_id)
         )
+        _index_text(cursor, post_id, text, COMMENT_TERM_WEIGHT)
+        _count_cluster_activity(cursor, post[0], comments=1)
         
         cursor.execute(
             "SELECT COUNT(*) FROM comments WHERE post_id = ?",
             (post_id,)
         )
         comment_count = cursor.fetchone()[0]
+    
+    _note_write(user_id)
+    _invalidate_feed(post_id=post_id, cluster_stats=True)
+    return comment_count
+
+def comment_page_size(limit=None):
+    if limit is None:
+        return COMMENT_PAGE_SIZE
+    return max(1, min(int(limit), COMMENT_MAX_PAGE_SIZE))
+
+def get_next_comment_cursor(comments, has_more):
+    """Cursor for the comments older than ``comments`` (oldest first), or None."""
+    if not comments or not has_more:
+        return None
+    oldest = comments[0]
+    return encode_feed_cursor(oldest['created_at'], oldest['id'])
+
+def get_comments_for_post(post_id, limit=COMMENT_PAGE_SIZE, before=None):
+    """A page of up to ``limit`` comments older than the ``before`` cursor (the
+    newest comments when None), oldest first. Returns {'comments', 'next_cursor'}."""
+    limit = comment_page_size(limit)
+    conditions = ['c.post_id = ?']
+    params = [post_id]
+    if before:
+        created_at, comment_id = decode_feed_cursor(before)
+        conditions.append('c.created_at < ? AND (c.created_at < ? OR c.id < ?)')
+        params.extend([created_at + timedelta(microseconds=1), created_at, comment_id])
+    
+    with get_read_cursor() as cursor:
+        cursor.execute(f'''
+            SELECT c.id, c.text, c.author, c.user_id, c.created_at
+            FROM comments c
+            WHERE {' AND '.join(conditions)}
+            ORDER BY c.created_at DESC, c.id DESC
+            {get_backend().limit_clause}
+        ''', params + [limit + 1])
+        rows = cursor.fetchall()
+    
+    comments = [_comment_dict(comment) for comment in reversed(rows[:limit])]
+    comments = _with_comment_pictures(comments, get_user_pictures(comment['user_id'] for comment in comments))
+    return {
+        'comments': comments,
+        'next_cursor': get_next_comment_cursor(comments, len(rows) > limit)
+    }
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+SEARCH_MAX_OFFSET = 1000
+SEARCH_MAX_TERMS = 8
+# Multi-term queries score at most this many of the rarest term's best postings
+SEARCH_MAX_CANDIDATES = 5000
+# Occurrences in comments count for less than the post's own text
+COMMENT_TERM_WEIGHT = 0.5
+# BM25 term-frequency saturation
+SEARCH_K1 = 1.2
+# 3 parameters per posting keeps each statement under SQL Server's 2100-parameter cap
+SEARCH_BATCH_SIZE = 500
+
+def _index_text(cursor, post_id, text, weight=1.0, new_post=False):
+    """Add the terms of ``text`` to the postings of ``post_id`` in the caller's transaction."""
+    counts = Counter(tokenize(text))
+    if not counts:
+        return
+    backend = get_backend()
+    terms = sorted(counts)
+    new_terms = terms
+    if not new_post:
+        existing = set()
+        for batch in _chunks(terms, SEARCH_BATCH_SIZE):
+            cursor.execute(f'''
+                SELECT term FROM search_postings
+                WHERE post_id = ? AND term IN ({', '.join('?' * len(batch))})
+            ''', [post_id] + batch)
+            existing.update(row[0] for row in cursor.fetchall())
+        new_terms = [term for term in terms if term not in existing]
+    
+    for batch in _chunks(terms, SEARCH_BATCH_SIZE):
+        params = []
+        for term in batch:
+            params.extend((term, post_id, counts[term] * weight))
+        cursor.execute(backend.upsert_sql(
+            'search_postings',
+            ('term', 'post_id'),
+            {'weight': '?'},
+            {'weight': 'search_postings.weight + excluded.weight'},
+            rows=len(batch)
+        ), params)
+    for batch in _chunks(new_terms, SEARCH_BATCH_SIZE):
+        cursor.execute(backend.upsert_sql(
+            'search_terms',
+            ('term',),
+            {'doc_count': '1'},
+            {'doc_count': 'search_terms.doc_count + 1'},
+            rows=len(batch)
+        ), batch)
+
+def build_search_index(cursor):
+    """Rebuild search_postings and search_terms from every post and comment."""
+    backend = get_backend()
+    cursor.execute('DELETE FROM search_postings')
+    cursor.execute('DELETE FROM search_terms')
+    
+    doc_counts = Counter()
+    last_id = 0
+    while True:
+        cursor.execute(f'''
+            SELECT id, content FROM posts
+            WHERE id > ?
+            ORDER BY id
+            {backend.limit_clause}
+        ''', (last_id, FEED_BATCH_SIZE))
+        posts = cursor.fetchall()
+        if not posts:
+            break
+        last_id = posts[-1][0]
+        
+        postings = Counter()
+        for post_id, content in posts:
+            for term, count in Counter(tokenize(content)).items():
+                postings[(term, post_id)] += count
+        post_ids = [post[0] for post in posts]
+        cursor.execute(f'''
+            SELECT post_id, text FROM comments
+            WHERE post_id IN ({', '.join('?' * len(post_ids))})
+        ''', post_ids)
+        for post_id, text in cursor.fetchall():
+            for term, count in Counter(tokenize(text)).items():
+                postings[(term, post_id)] += count * COMMENT_TERM_WEIGHT
+        doc_counts.update(term for term, post_id in postings)
         
-        return comment_count
+        for batch in _chunks(sorted(postings.items()), SEARCH_BATCH_SIZE):
+            params = []
+            for (term, post_id), weight in batch:
+                params.extend((term, post_id, weight))
+            cursor.execute(
+                f"INSERT INTO search_postings (term, post_id, weight) VALUES {', '.join(['(?, ?, ?)'] * len(batch))}",
+                params
+            )
+    
+    for batch in _chunks(sorted(doc_counts.items()), SEARCH_BATCH_SIZE):
+        cursor.execute(
+            f"INSERT INTO search_terms (term, doc_count) VALUES {', '.join(['(?, ?)'] * len(batch))}",
+            [value for item in batch for value in item]
+        )
 
-def get_comments_for_post(post_id):
+def rebuild_search_index():
     with get_db_cursor() as cursor:
-        cursor.execute('''
-            SELECT c.text, c.author, c.user_id, u.profile_picture as author_picture, c.created_at 
-            FROM comments c 
-            LEFT JOIN users u ON c.user_id = u.id
-            WHERE c.post_id = ? 
-            ORDER BY c.created_at ASC
-        ''', (post_id,))
-        comments = cursor.fetchall()
+        build_search_index(cursor)
+
+def search_posts(query, limit=SEARCH_PAGE_SIZE, offset=0):
+    """Ranked full-text search over posts and their comments.
+
+    Every query term has to appear in the post or one of its comments. Returns
+    {'posts', 'terms', 'next_offset'}; each post carries its 'score'.
+    """
+    limit = max(1, min(limit or SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE))
+    offset = max(0, offset or 0)
+    if offset > SEARCH_MAX_OFFSET:
+        raise ValueError(f"Search offset is limited to {SEARCH_MAX_OFFSET}")
+    
+    terms = list(dict.fromkeys(tokenize(query)))[:SEARCH_MAX_TERMS]
+    result = {'posts': [], 'terms': list(terms), 'next_offset': None}
+    if not terms:
+        return result
+    
+    with get_read_cursor() as cursor:
+        cursor.execute(
+            f"SELECT term, doc_count FROM search_terms WHERE term IN ({', '.join('?' * len(terms))})",
+            terms
+        )
+        doc_counts = dict(cursor.fetchall())
+        if len(doc_counts) < len(terms):
+            return result
         
-        return [{
-            'text': comment[0],
-            'author': comment[1],
-            'user_id': comment[2],
-            'author_picture': comment[3],
-            'created_at': comment[4]
-        } for comment in comments]
+        # Ids only grow, so MAX(id) is a cheap stand-in for the number of posts.
+        cursor.execute('SELECT MAX(id) FROM posts')
+        total = cursor.fetchone()[0] or 0
+        
+        # The rarest term drives the query; the others are primary-key seeks.
+        terms.sort(key=lambda term: doc_counts[term])
+        idf = [math.log(1 + (total - doc_counts[term] + 0.5) / (doc_counts[term] + 0.5)) for term in terms]
+        score = ' + '.join(f'? * p{i}.weight / (p{i}.weight + {SEARCH_K1})' for i in range(len(terms)))
+        joins = ''.join(
+            f' JOIN search_postings p{i} ON p{i}.term = ? AND p{i}.post_id = p0.post_id'
+            for i in range(1, len(terms))
+        )
+        backend = get_backend()
+        if len(terms) == 1:
+            # The score follows the weight, which the index already orders.
+            cursor.execute(f'''
+                SELECT p0.post_id, {score} AS score
+                FROM search_postings p0
+                WHERE p0.term = ?
+                ORDER BY p0.weight DESC, p0.post_id DESC
+                {backend.page_clause}
+            ''', idf + [terms[0], offset, limit + 1])
+        else:
+            cursor.execute(f'''
+                SELECT p0.post_id, {score} AS score
+                FROM (
+                    SELECT post_id, weight FROM search_postings
+                    WHERE term = ?
+                    ORDER BY weight DESC, post_id DESC
+                    {backend.limit_clause}
+                ) p0{joins}
+                ORDER BY score DESC, p0.post_id DESC
+                {backend.page_clause}
+            ''', idf + [terms[0], SEARCH_MAX_CANDIDATES] + terms[1:] + [offset, limit + 1])
+        hits = cursor.fetchall()
+        
+        scores = dict(hits[:limit])
+        if scores:
+            cursor.execute(
+                f"{_FEED_POSTS_SQL} WHERE p.id IN ({', '.join('?' * len(scores))})",
+                list(scores)
+            )
+            posts = {post['id']: post for post in _load_feed(cursor, cursor.fetchall())}
+            for post_id, post_score in scores.items():
+                if post_id in posts:
+                    posts[post_id]['score'] = post_score
+                    result['posts'].append(posts[post_id])
+    
+    if len(hits) > limit:
+        result['next_offset'] = offset + limit
+    result['posts'] = _with_author_pictures(result['posts'])
+    return result
+
+EXPORT_PAGE_SIZE = 5000
+
+_EXPORT_TABLES = {
+    'posts': ('post', ('id', 'content', 'author', 'user_id', 'post_type', 'post_image', 'cluster', 'created_at')),
+    'comments': ('comment', ('id', 'post_id', 'user_id', 'author', 'text', 'created_at')),
+    'reactions': ('reaction', ('id', 'post_id', 'user_id', 'reaction_type', 'created_at')),
+}
+
+def _iter_table(table, columns, page_size):
+    # Keyset pages, each read whole in its own short transaction. The connection
+    # goes back to the pool before any row is yielded, so a slow client never
+    # holds a pool slot or an open transaction; memory is bounded by page_size.
+    last_id = 0
+    while True:
+        with get_read_cursor() as cursor:
+            cursor.execute(f'''
+                SELECT {', '.join(columns)}
+                FROM {table}
+                WHERE id > ?
+                ORDER BY id
+                {get_backend().limit_clause}
+            ''', (last_id, page_size))
+            rows = cursor.fetchall()
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1][0]
+
+def _export_lines(tables, page_size):
+    for table in tables:
+        record_type, columns = _EXPORT_TABLES[table]
+        for row in _iter_table(table, columns, page_size):
+            record = {'type': record_type}
+            record.update(zip(columns, row))
+            yield json.dumps(record, default=str, ensure_ascii=False) + '\n'
+
+def export_community(tables=None, page_size=EXPORT_PAGE_SIZE):
+    """Return a generator of newline-delimited JSON lines for posts, comments and
+    reactions; nothing is read until it is iterated."""
+    tables = list(tables or _EXPORT_TABLES)
+    for table in tables:
+        if table not in _EXPORT_TABLES:
+            raise ValueError(f"Cannot export table: {table}")
+    return _export_lines(tables, page_size)
+
+_SEARCH_HISTORY_COLUMNS = ('user_id', 'search_uuid', 'location', 'clinics_found')
 
 def save_search_history(user_id, search_uuid, location, clinics_found):
     with get_db_cursor() as cursor:
         try:
             cursor.execute(
-                "INSERT INTO search_history (user_id, search_uuid, location, clinics_found) OUTPUT INSERTED.id VALUES (?, ?, ?, ?)",
+                get_backend().insert_sql('search_history', _SEARCH_HISTORY_COLUMNS),
                 (user_id, search_uuid, location, clinics_found)
             )
+            _note_write(user_id)
             return cursor.fetchone()[0]
         except Exception as e:
             raise e
 
+_VETERINARIAN_COLUMNS = ('search_uuid', 'name', 'phone', 'address', 'website', 'rating', 'reviews', 'latitude', 'longitude', 'hours')
+
+# 10 parameters per clinic keeps each statement under SQL Server's 2100-parameter cap
+VETERINARIAN_BATCH_SIZE = 200
+
+def _veterinarian_params(search_uuid, clinic_data):
+    return (
+        search_uuid,
+        clinic_data.get('name', ''),
+        clinic_data.get('phone', ''),
+        clinic_data.get('address', ''),
+        clinic_data.get('website', ''),
+        clinic_data.get('rating', 0),
+        clinic_data.get('reviews', 0),
+        clinic_data.get('latitude'),
+        clinic_data.get('longitude'),
+        json.dumps(clinic_data.get('hours', {})) if clinic_data.get('hours') else None
+    )
+
 def save_veterinarian_details(search_uuid, clinic_data):
     with get_db_cursor() as cursor:
-        try:
-            cursor.execute('''
-                INSERT INTO veterinarians 
-                (search_uuid, name, phone, address, website, rating, reviews, latitude, longitude, hours)
-                OUTPUT INSERTED.id
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                search_uuid,
-                clinic_data.get('name', ''),
-                clinic_data.get('phone', ''),
-                clinic_data.get('address', ''),
-                clinic_data.get('website', ''),
-                clinic_data.get('rating', 0),
-                clinic_data.get('reviews', 0),
-                clinic_data.get('latitude'),
-                clinic_data.get('longitude'),
-                json.dumps(clinic_data.get('hours', {})) if clinic_data.get('hours') else None
-            ))
-            return cursor.fetchone()[0]
-        except Exception as e:
-            raise e
+        cursor.execute(
+            get_backend().insert_sql('veterinarians', _VETERINARIAN_COLUMNS),
+            _veterinarian_params(search_uuid, clinic_data)
+        )
+        return cursor.fetchone()[0]
 
-def get_search_history(user_id, limit=10):
+def save_search_results(user_id, search_uuid, location, clinics):
+    """Store a search and all of its clinics in one transaction.
+
+    Returns (search_history_id, [veterinarian ids]). The ids come back in
+    ascending order, not the order of ``clinics``: neither OUTPUT nor RETURNING
+    on a multi-row insert guarantees row order.
+    """
     with get_db_cursor() as cursor:
-        cursor.execute('''
+        cursor.execute(
+            get_backend().insert_sql('search_history', _SEARCH_HISTORY_COLUMNS),
+            (user_id, search_uuid, location, len(clinics))
+        )
+        search_id = cursor.fetchone()[0]
+        
+        veterinarian_ids = []
+        for batch in _chunks(clinics, VETERINARIAN_BATCH_SIZE):
+            params = []
+            for clinic_data in batch:
+                params.extend(_veterinarian_params(search_uuid, clinic_data))
+            cursor.execute(
+                get_backend().insert_sql('veterinarians', _VETERINARIAN_COLUMNS, rows=len(batch)),
+                params
+            )
+            veterinarian_ids.extend(row[0] for row in cursor.fetchall())
+    
+    _note_write(user_id)
+    return search_id, sorted(veterinarian_ids)
+
+def get_search_history(user_id, limit=10):
+    with get_read_cursor(user_id) as cursor:
+        cursor.execute(f'''
             SELECT sh.id, sh.search_uuid, sh.location, sh.search_date, sh.clinics_found,
                    COUNT(v.id) as vets_saved
             FROM search_history sh
@@ -643,7 +1314,7 @@ def get_search_history(user_id, limit=10):
             WHERE sh.user_id = ?
             GROUP BY sh.id, sh.search_uuid, sh.location, sh.search_date, sh.clinics_found
             ORDER BY sh.search_date DESC
-            OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY
+            {get_backend().limit_clause}
         ''', (user_id, limit))
         
         history = cursor.fetchall()
@@ -658,7 +1329,7 @@ def get_search_history(user_id, limit=10):
         } for item in history]
 
 def get_search_results(search_uuid):
-    with get_db_cursor() as cursor:
+    with get_read_cursor() as cursor:
         cursor.execute('''
             SELECT sh.location, sh.search_date, sh.clinics_found
             FROM search_history sh
@@ -706,78 +1377,161 @@ def get_search_results(search_uuid):
             'clinics': clinics_data
         }
 
-def save_chat_message(user_id, message, response, is_user_message, session_id):
+_CHAT_COLUMNS = ('user_id', 'message', 'response', 'is_user_message', 'session_id')
+
+# 5 parameters per turn keeps each statement under SQL Server's 2100-parameter cap
+CHAT_BATCH_SIZE = 400
+
+def _touch_chat_session(cursor, user_id, session_id, message, count=1):
+    cursor.execute(get_backend().upsert_sql(
+        'chat_sessions',
+        ('user_id', 'session_id'),
+        {'last_activity': 'CURRENT_TIMESTAMP', 'last_message': '?', 'message_count': '?'},
+        {
+            'last_activity': 'excluded.last_activity',
+            'last_message': 'excluded.last_message',
+            'message_count': 'chat_sessions.message_count + excluded.message_count'
+        }
+    ), (user_id, session_id, message, count))
+
+def save_chat_turns(turns):
+    """Store (user_id, session_id, message, response) turns, one row each, in one transaction."""
+    if not turns:
+        return []
+    
+    chat_ids = []
+    sessions = {}
     with get_db_cursor() as cursor:
-        try:
-            cursor.execute('''
-                INSERT INTO chat_history (user_id, message, response, is_user_message, session_id)
-                OUTPUT INSERTED.id
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, message, response, is_user_message, session_id))
-            
-            return cursor.fetchone()[0]
-        except Exception as e:
-            raise e
+        for batch in _chunks(turns, CHAT_BATCH_SIZE):
+            params = []
+            for user_id, session_id, message, response in batch:
+                params.extend((user_id, message, response, True, session_id))
+                last_message, count = sessions.get((user_id, session_id), (None, 0))
+                sessions[(user_id, session_id)] = (message, count + 1)
+            cursor.execute(get_backend().insert_sql('chat_history', _CHAT_COLUMNS, rows=len(batch)), params)
+            chat_ids.extend(row[0] for row in cursor.fetchall())
+        
+        # Sorted so concurrent batches lock chat_sessions rows in the same order
+        for (user_id, session_id), (message, count) in sorted(sessions.items()):
+            _touch_chat_session(cursor, user_id, session_id, message, count)
+    
+    _note_write(*{turn[0] for turn in turns})
+    return chat_ids
+
+_chat_writer = WriteBehindQueue(
+    save_chat_turns,
+    max_size=CHAT_QUEUE_SIZE,
+    batch_size=CHAT_BATCH_SIZE,
+    flush_interval=CHAT_FLUSH_INTERVAL,
+    name='chat-history-writer',
+    # Ids only; the messages themselves stay out of the logs
+    describe=lambda turns: ', '.join(f"user {turn[0]} session {turn[1]}" for turn in turns)
+)
+
+def queue_chat_turn(user_id, message, response, session_id):
+    """Persist a chat turn in the background; blocks only when the queue is full.
+    Raises if the queue was full and writing the turn directly failed too."""
+    _chat_writer.put((user_id, session_id, message, response))
+    # The turn is written by another thread, so the window opens here
+    _note_write(user_id)
+
+def flush_chat_queue(timeout=CHAT_FLUSH_TIMEOUT):
+    return _chat_writer.flush(timeout)
+
+def close_chat_queue(timeout=10):
+    """Shutdown hook: write out everything still queued."""
+    return _chat_writer.close(timeout)
+
+def get_chat_queue_stats():
+    return _chat_writer.stats()
+
+def _flush_pending_chat():
+    # Readers should see turns that were queued before they asked.
+    if _chat_writer.pending():
+        _chat_writer.flush(CHAT_FLUSH_TIMEOUT)
+
+def save_chat_message(user_id, message, response, is_user_message, session_id):
+    """Synchronously store one chat turn. is_user_message is accepted for older
+    callers; every row now holds a whole turn."""
+    return save_chat_turns([(user_id, session_id, message, response)])[0]
 
 def get_chat_history(user_id, session_id=None, limit=50):
-    with get_db_cursor() as cursor:
+    _flush_pending_chat()
+    # Each row is one turn, returned as a user entry and a bot entry.
+    turn_limit = (limit + 1) // 2
+    with get_read_cursor(user_id) as cursor:
         if session_id:
-            cursor.execute('''
-                SELECT message, response, is_user_message, created_at, session_id
+            cursor.execute(f'''
+                SELECT message, response, created_at, session_id
                 FROM chat_history
                 WHERE user_id = ? AND session_id = ?
-                ORDER BY created_at ASC
-                OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY
-            ''', (user_id, session_id, limit))
+                ORDER BY created_at ASC, id ASC
+                {get_backend().limit_clause}
+            ''', (user_id, session_id, turn_limit))
         else:
-            cursor.execute('''
-                SELECT message, response, is_user_message, created_at, session_id
+            cursor.execute(f'''
+                SELECT message, response, created_at, session_id
                 FROM chat_history
                 WHERE user_id = ?
-                ORDER BY created_at DESC
-                OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY
-            ''', (user_id, limit))
+                ORDER BY created_at DESC, id DESC
+                {get_backend().limit_clause}
+            ''', (user_id, turn_limit))
         
-        messages = cursor.fetchall()
-        
-        return [{
-            'message': msg[0],
-            'response': msg[1],
-            'is_user_message': bool(msg[2]),
-            'created_at': msg[3],
-            'session_id': msg[4]
-        } for msg in messages]
-
-def get_chat_sessions(user_id):
-    with get_db_cursor() as cursor:
-        cursor.execute('''
-            SELECT DISTINCT session_id, MAX(created_at) as last_activity,
-                   (SELECT TOP 1 message FROM chat_history 
-                    WHERE user_id = ? AND session_id = ch.session_id 
-                    ORDER BY created_at DESC) as last_message
-            FROM chat_history ch
+        turns = cursor.fetchall()
+    
+    messages = []
+    for turn in turns:
+        user_message = {
+            'message': turn[0],
+            'response': turn[1],
+            'is_user_message': True,
+            'created_at': turn[2],
+            'session_id': turn[3]
+        }
+        bot_message = dict(user_message, is_user_message=False)
+        if session_id:
+            messages.extend([user_message, bot_message])
+        else:
+            messages.extend([bot_message, user_message])
+    return messages[:limit]
+
+def get_chat_sessions(user_id, limit=20):
+    """The user's latest sessions. ``message_count`` counts turns, a message
+    and its response, as stored one per chat_history row."""
+    _flush_pending_chat()
+    with get_read_cursor(user_id) as cursor:
+        cursor.execute(f'''
+            SELECT session_id, last_activity, last_message, message_count
+            FROM chat_sessions
             WHERE user_id = ?
-            GROUP BY session_id
             ORDER BY last_activity DESC
-            OFFSET 0 ROWS FETCH NEXT 20 ROWS ONLY
-        ''', (user_id, user_id))
+            {get_backend().limit_clause}
+        ''', (user_id, limit))
         
         sessions = cursor.fetchall()
         
         return [{
             'session_id': session[0],
             'last_activity': session[1],
-            'last_message': session[2] or 'No messages'
+            'last_message': session[2] or 'No messages',
+            'message_count': session[3]
         } for session in sessions]
 
 def delete_chat_session(user_id, session_id):
+    """Delete a chat session; returns the number of turns deleted, in the
+    same unit as get_chat_sessions()' message_count."""
+    _flush_pending_chat()
     with get_db_cursor() as cursor:
-        try:
-            cursor.execute('''
-                DELETE FROM chat_history
-                WHERE user_id = ? AND session_id = ?
-            ''', (user_id, session_id))
-            
-            return cursor.rowcount
-        except Exception as e:
-            raise e
\ No newline at end of file
+        cursor.execute('''
+            DELETE FROM chat_history
+            WHERE user_id = ? AND session_id = ?
+        ''', (user_id, session_id))
+        deleted_count = cursor.rowcount
+        
+        cursor.execute('''
+            DELETE FROM chat_sessions
+            WHERE user_id = ? AND session_id = ?
+        ''', (user_id, session_id))
+        
+        _note_write(user_id)
+        return deleted_count
\ No newline at end of file
@@ -0,0 +1,284 @@
+"""Reproducible synthetic community data for benchmarks.
+
+Every table is sized relative to the number of posts (see ROW_RATIOS), and
+the same ``seed`` always produces the same rows. Activity is skewed the way a
+real forum's is: post popularity, commenting, chatting and vet searches
+follow a Zipf distribution, so a handful of viral posts collect most of the
+comments and reactions and a few heavy users do most of the chatting.
+
+Rows are bulk inserted, so the derived tables (reaction counts, chat
+sessions, cluster statistics and the search index) are rebuilt at the end.
+Load into an empty database, not a live one.
+
+    python datagen.py --posts 100000 --sqlite bench.db
+    python datagen.py --posts 1000000 --backend mssql --seed 7
+"""
+import argparse
+import bisect
+import json
+import random
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+import database
+from database import get_backend, get_db_cursor
+
+DEFAULT_SEED = 42
+# Rows per post for every other table
+ROW_RATIOS = {
+    'users': 0.1,
+    'comments': 2.0,
+    'reactions': 3.0,
+    'chat_history': 1.5,
+    'search_history': 0.05,
+}
+CLINICS_PER_SEARCH = (0, 20)
+ZIPF_EXPONENT = 1.1
+DATA_SPAN_DAYS = 365
+# Activity ends here rather than at the current time, so a seed gives the same
+# rows on every run and results from different days stay comparable. Date-windowed
+# reads of generated data take it as their reference time: benchmark.py passes the
+# newest post's date to get_trending_clusters, and retention.py takes --as-of.
+DATA_END = datetime(2025, 1, 1)
+# Rows per transaction; each statement stays under SQL Server's 2100-parameter
+# and 1000-row VALUES caps
+LOAD_BATCH_SIZE = 10000
+
+CLUSTERS = {'general': 30, 'health': 25, 'behavior': 20, 'funny': 15, 'lost_found': 10}
+POST_TYPES = {'story': 30, 'advice': 20, 'inquiry': 20, 'help': 15, 'lost_cat': 5, 'other': 10}
+REACTION_TYPES = {'like': 60, 'love': 20, 'haha': 8, 'wow': 5, 'sad': 5, 'angry': 2}
+ARABIC_SHARE = 0.3
+
+FIRST_NAMES = ['Ahmed', 'Mona', 'Omar', 'Sara', 'Youssef', 'Nour', 'Karim', 'Laila', 'Hassan', 'Mariam',
+               'John', 'Emma', 'Adam', 'Lina', 'Ali', 'Farah', 'Tarek', 'Dina', 'Khaled', 'Hana']
+LAST_NAMES = ['Hassan', 'Mahmoud', 'Ibrahim', 'Saleh', 'Fathy', 'Nabil', 'Smith', 'Adel', 'Kamal', 'Samir']
+LOCATIONS = {
+    'cairo': (30.0444, 31.2357),
+    'alexandria': (31.2001, 29.9187),
+    'giza': (30.0131, 31.2089),
+    'mansoura': (31.0409, 31.3785),
+    'tanta': (30.7865, 31.0004),
+}
+ENGLISH_WORDS = (
+    'cat kitten vet food litter box play sleep purr meow scratch toy fur hair brush vaccine '
+    'appetite vomiting sneezing eyes ears teeth claws weight diet water fountain window bird '
+    'mouse garden lost found adopted rescue shelter street orange tabby black white grey '
+    'persian siamese baladi calm angry hungry tired happy sick healthy tiny fluffy lazy night '
+    'morning medicine pills fever clinic doctor checkup neutered spayed fleas worms'
+).split()
+ARABIC_WORDS = (
+    'قطة قطط قطي قطتي بسة القطط الطبيب البيطري اكل أكل طعام رمل لعب نوم مواء شعر فرو تطعيم '
+    'شهية ترجيع عطس عيون أذن اسنان مخالب وزن مياه شباك عصفور فار ضايعة لقيتها تبني ملجأ شارع '
+    'برتقالي أسود ابيض رمادي شيرازي بلدي هادية جعانة تعبانة مريضة صغيرة كسولة بالليل الصبح دوا '
+    'حرارة عيادة دكتور كشف تعقيم براغيث ديدان'
+).split()
+CHAT_QUESTIONS = [
+    'Why is my cat not eating?',
+    'How often should I take my cat to the vet?',
+    'What are signs of a sick cat?',
+    'Is it normal for a kitten to sleep all day?',
+    'ليه قطتي مش بتاكل؟',
+    'امتى لازم اطعم القطة؟',
+]
+
+def _weighted(rng, weights):
+    names = list(weights)
+    cumulative = list(accumulate(weights.values()))
+    return lambda: names[bisect.bisect(cumulative, rng.random() * cumulative[-1])]
+
+def _zipf(rng, count, exponent=ZIPF_EXPONENT):
+    """Sampler of indexes in range(count) where the k-th most popular index is
+    drawn with probability proportional to 1 / k ** exponent. Which indexes
+    are popular is shuffled, so popularity does not follow insertion order."""
+    cumulative = list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+    popular = list(range(count))
+    rng.shuffle(popular)
+    return lambda: popular[min(bisect.bisect(cumulative, rng.random() * cumulative[-1]), count - 1)]
+
+def _text(rng, min_words, max_words):
+    words = ARABIC_WORDS if rng.random() < ARABIC_SHARE else ENGLISH_WORDS
+    return ' '.join(rng.choice(words) for _ in range(rng.randint(min_words, max_words)))
+
+def _after(rng, moment, mean_hours, now):
+    # Replies cluster shortly after the post, with a long tail
+    return min(moment + timedelta(hours=rng.expovariate(1 / mean_hours)), now)
+
+def _insert(table, columns, rows):
+    """Bulk insert ``rows``, LOAD_BATCH_SIZE per transaction; returns the row count."""
+    per_statement = min(1000, 2000 // len(columns))
+    row_sql = f"({', '.join('?' * len(columns))})"
+    inserted = 0
+    batch = []
+
+    def flush():
+        with get_db_cursor() as cursor:
+            for start in range(0, len(batch), per_statement):
+                chunk = batch[start:start + per_statement]
+                cursor.execute(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([row_sql] * len(chunk))}",
+                    [value for row in chunk for value in row]
+                )
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= LOAD_BATCH_SIZE:
+            flush()
+            inserted += len(batch)
+            batch = []
+    if batch:
+        flush()
+        inserted += len(batch)
+    return inserted
+
+def _max_id(table):
+    with get_db_cursor() as cursor:
+        cursor.execute(f"SELECT MAX(id) FROM {table}")
+        return cursor.fetchone()[0] or 0
+
+def _ids_after(table, first_id, columns='id'):
+    with get_db_cursor() as cursor:
+        cursor.execute(f"SELECT {columns} FROM {table} WHERE id > ? ORDER BY id", (first_id,))
+        return cursor.fetchall()
+
+def _users(rng, count, first_id, start, span):
+    # Accounts are opened during the span before the first post
+    password = database.hash_password('password123')
+    for index in range(count):
+        gender = rng.choice(('male', 'female'))
+        yield (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), f"user{first_id + index + 1}@bench.example",
+               password, gender, f"{gender}.png", start - span * rng.random())
+
+def _posts(rng, count, users, start, span):
+    pick_author = _zipf(rng, len(users))
+    cluster = _weighted(rng, CLUSTERS)
+    post_type = _weighted(rng, POST_TYPES)
+    for index in range(count):
+        user_id, first_name, last_name = users[pick_author()]
+        created_at = start + span * ((index + rng.random()) / count)
+        image = f"bench_{index}.jpg" if rng.random() < 0.1 else None
+        yield (_text(rng, 8, 60), f"{first_name} {last_name}", user_id, post_type(), image, cluster(), created_at)
+
+def _per_post(rng, total, post_count):
+    pick_post = _zipf(rng, post_count)
+    return sorted(Counter(pick_post() for _ in range(total)).items())
+
+def _comments(rng, total, posts, users, now):
+    pick_author = _zipf(rng, len(users))
+    for post_index, count in _per_post(rng, total, len(posts)):
+        post_id, created_at = posts[post_index]
+        for _ in range(count):
+            user_id, first_name, last_name = users[pick_author()]
+            yield (_text(rng, 2, 25), f"{first_name} {last_name}", user_id, post_id, _after(rng, created_at, 6, now))
+
+def _reactions(rng, total, posts, users, now):
+    reaction_type = _weighted(rng, REACTION_TYPES)
+    for post_index, count in _per_post(rng, total, len(posts)):
+        post_id, created_at = posts[post_index]
+        # One reaction per user and post
+        for user_index in rng.sample(range(len(users)), min(count, len(users))):
+            yield (users[user_index][0], post_id, reaction_type(), _after(rng, created_at, 12, now))
+
+def _chat_turns(rng, total, users, start, span):
+    pick_user = _zipf(rng, len(users))
+    sessions = {}
+    for _ in range(total):
+        user_id = users[pick_user()][0]
+        # Most turns continue the user's current conversation
+        if user_id not in sessions or rng.random() < 0.15:
+            sessions[user_id] = (f"chat_{user_id}_{rng.getrandbits(32):08x}", start + span * rng.random())
+        session_id, started_at = sessions[user_id]
+        asked_at = started_at + timedelta(minutes=rng.expovariate(1 / 10))
+        sessions[user_id] = (session_id, asked_at)
+        yield (user_id, rng.choice(CHAT_QUESTIONS), _text(rng, 20, 120), 1, session_id, asked_at)
+
+def _searches(rng, total, users, start, span):
+    pick_user = _zipf(rng, len(users))
+    searches = []
+    for _ in range(total):
+        user_id = users[pick_user()][0] if rng.random() < 0.9 else None
+        searches.append((user_id, str(uuid.UUID(int=rng.getrandbits(128))), rng.choice(list(LOCATIONS)),
+                         start + span * rng.random(), rng.randint(*CLINICS_PER_SEARCH)))
+    return searches
+
+def _clinics(rng, searches):
+    for _, search_uuid, location, searched_at, clinics_found in searches:
+        latitude, longitude = LOCATIONS[location]
+        for index in range(clinics_found):
+            yield (search_uuid, f"{rng.choice(LAST_NAMES)} Veterinary Clinic {index + 1}",
+                   f"+20 1{rng.randint(0, 2)} {rng.randint(1000, 9999)} {rng.randint(1000, 9999)}",
+                   f"{rng.randint(1, 200)} Street, {location.title()}", None,
+                   round(rng.uniform(3.0, 5.0), 1), int(rng.paretovariate(1.2) * 10),
+                   latitude + rng.uniform(-0.05, 0.05), longitude + rng.uniform(-0.05, 0.05),
+                   '9 AM - 10 PM', searched_at)
+
+def generate(posts, seed=DEFAULT_SEED, progress=print, end=DATA_END):
+    """Load ``posts`` posts and proportional rows into every community table,
+    dated over the DATA_SPAN_DAYS before ``end``.
+
+    Returns the number of rows inserted per table.
+    """
+    rng = random.Random(seed)
+    database.init_db()
+    now = end
+    span = timedelta(days=DATA_SPAN_DAYS)
+    start = now - span
+    counts = {table: max(1, int(posts * ratio)) for table, ratio in ROW_RATIOS.items()}
+    inserted = {}
+
+    def load(table, columns, rows):
+        started = time.perf_counter()
+        inserted[table] = _insert(table, columns, rows)
+        if progress:
+            progress(f"{table}: {inserted[table]} rows in {time.perf_counter() - started:.1f}s")
+
+    first_user = _max_id('users')
+    load('users', ('first_name', 'last_name', 'email', 'password', 'gender', 'profile_picture', 'created_at'),
+         _users(rng, counts['users'], first_user, start, span))
+    users = _ids_after('users', first_user, 'id, first_name, last_name')
+
+    first_post = _max_id('posts')
+    load('posts', ('content', 'author', 'user_id', 'post_type', 'post_image', 'cluster', 'created_at'),
+         _posts(rng, posts, users, start, span))
+    post_rows = _ids_after('posts', first_post, 'id, created_at')
+
+    load('comments', ('text', 'author', 'user_id', 'post_id', 'created_at'),
+         _comments(rng, counts['comments'], post_rows, users, now))
+    load('reactions', ('user_id', 'post_id', 'reaction_type', 'created_at'),
+         _reactions(rng, counts['reactions'], post_rows, users, now))
+    load('chat_history', ('user_id', 'message', 'response', 'is_user_message', 'session_id', 'created_at'),
+         _chat_turns(rng, counts['chat_history'], users, start, span))
+    searches = _searches(rng, counts['search_history'], users, start, span)
+    load('search_history', ('user_id', 'search_uuid', 'location', 'search_date', 'clinics_found'), searches)
+    load('veterinarians', ('search_uuid', 'name', 'phone', 'address', 'website', 'rating', 'reviews',
+                           'latitude', 'longitude', 'hours', 'saved_at'), _clinics(rng, searches))
+
+    started = time.perf_counter()
+    database.rebuild_counters()
+    database.rebuild_cluster_stats()
+    database.rebuild_search_index()
+    if get_backend().name == 'sqlite':
+        with get_db_cursor() as cursor:
+            cursor.execute('ANALYZE')
+    if progress:
+        progress(f"derived tables rebuilt in {time.perf_counter() - started:.1f}s")
+    return inserted
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load reproducible synthetic community data.')
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--backend', choices=('mssql', 'sqlite'))
+    parser.add_argument('--sqlite', metavar='PATH', help='load into this SQLite file')
+    args = parser.parse_args(argv)
+
+    if args.sqlite:
+        database.configure_database('sqlite', path=args.sqlite)
+    elif args.backend:
+        database.configure_database(args.backend)
+    print(json.dumps(generate(args.posts, args.seed), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import re
+
+MAX_TERM_LENGTH = 64
+
+_TOKEN = re.compile(r'\w+')
+_ARABIC = re.compile('[\u0600-\u06ff]')
+# Harakat, Quranic annotation marks, superscript alef and tatweel
+_ARABIC_MARKS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_ARABIC_FOLD = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+})
+_ARABIC_PREFIXES = ('وال', 'بال', 'كال', 'فال', 'لل', 'ال')
+_ARABIC_SUFFIXES = ('ات', 'ون', 'ين', 'ها')
+
+_ENGLISH_STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'from', 'has', 'have', 'he',
+    'her', 'his', 'i', 'if', 'in', 'into', 'is', 'it', 'its', 'me', 'my', 'not', 'of', 'on', 'or',
+    'our', 'she', 'so', 'that', 'the', 'their', 'them', 'then', 'there', 'these', 'they', 'this',
+    'to', 'was', 'we', 'were', 'what', 'when', 'where', 'which', 'who', 'will', 'with', 'you', 'your',
+}
+
+def _fold_arabic(word):
+    return _ARABIC_MARKS.sub('', word).translate(_ARABIC_FOLD)
+
+_ARABIC_STOPWORDS = {_fold_arabic(word) for word in (
+    'في', 'من', 'على', 'إلى', 'عن', 'أن', 'إن', 'هذا', 'هذه', 'ذلك', 'التي', 'الذي', 'هو', 'هي',
+    'كان', 'ما', 'لا', 'مع', 'أو', 'ثم', 'قد', 'لم', 'لن', 'كل', 'و', 'يا',
+)}
+
+def _stem_arabic(word):
+    # Light stemming: the definite article with its attached conjunctions and
+    # prepositions, then one plural/pronoun suffix, keeping at least 3 letters.
+    for prefix in _ARABIC_PREFIXES:
+        if word.startswith(prefix) and len(word) - len(prefix) >= 2:
+            word = word[len(prefix):]
+            break
+    for suffix in _ARABIC_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+def _stem_english(word):
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+def tokenize(text):
+    """Split Arabic/English text into normalized, lightly stemmed search terms.
+
+    Arabic is stripped of diacritics and tatweel with alef/yaa/taa-marbuta
+    variants folded; English is case-folded with plurals reduced. Stopwords
+    and single characters are dropped.
+    """
+    terms = []
+    # Marks first: they are not word characters and would split words apart.
+    for word in _TOKEN.findall(_ARABIC_MARKS.sub('', text or '')):
+        if _ARABIC.search(word):
+            word = _fold_arabic(word)
+            if word in _ARABIC_STOPWORDS:
+                continue
+            word = _stem_arabic(word)
+        else:
+            word = word.casefold()
+            if word in _ENGLISH_STOPWORDS:
+                continue
+            word = _stem_english(word)
+        if len(word) >= 2:
+            terms.append(word[:MAX_TERM_LENGTH])
+    return terms
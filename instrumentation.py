@@ -0,0 +1,229 @@
+import hashlib
+import logging
+import math
+import re
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+slow_query_logger = logging.getLogger('database.slow_queries')
+
+_STRING = re.compile(r"N?'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_WHITESPACE = re.compile(r'\s+')
+_PARAMETER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_REPEATED_LIST = re.compile(r'\(\?, \.\.\.\)(?:, \(\?, \.\.\.\))+')
+
+@lru_cache(maxsize=2048)
+def normalize_sql(sql):
+    """Reduce a statement to its shape: literals become ?, and IN/VALUES lists of
+    any length collapse, so 'IN (?, ?)' and 'IN (?, ?, ?)' share a fingerprint."""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    sql = _PARAMETER_LIST.sub('(?, ...)', sql)
+    return _REPEATED_LIST.sub('(?, ...), ...', sql)
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql):
+    normalized = normalize_sql(sql)
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12], normalized
+
+def _percentile(ordered, fraction):
+    # Nearest-rank on an already sorted sample.
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class QueryStats:
+    """Aggregated statement timings keyed by SQL fingerprint.
+
+    Each fingerprint keeps its last ``sample_size`` durations for p50/p95/p99.
+    Statements slower than ``slow_query_ms`` go to the 'database.slow_queries'
+    logger and to a bounded list of recent slow queries. Per-request totals
+    (round trips, connections, rows, time) are tracked per thread between
+    begin_request() and end_request().
+    """
+
+    def __init__(self, sample_size=1000, slow_query_ms=200, slow_log_size=100, max_fingerprints=500):
+        self.sample_size = sample_size
+        self.slow_query_ms = slow_query_ms
+        self.max_fingerprints = max_fingerprints
+        self._lock = threading.Lock()
+        self._fingerprints = {}
+        self._slow = deque(maxlen=slow_log_size)
+        self._local = threading.local()
+
+    def begin_request(self, label=None):
+        self._local.request = {
+            'label': label,
+            'statements': 0,
+            'connections': 0,
+            'rows': 0,
+            'db_time_ms': 0.0,
+            'slow_statements': 0
+        }
+
+    def end_request(self):
+        request = getattr(self._local, 'request', None)
+        self._local.request = None
+        return request
+
+    def current_request(self):
+        return getattr(self._local, 'request', None)
+
+    def connection_acquired(self):
+        request = getattr(self._local, 'request', None)
+        if request is not None:
+            request['connections'] += 1
+
+    def record(self, sql, elapsed, rows):
+        key, normalized = fingerprint(sql)
+        elapsed_ms = elapsed * 1000
+        slow = self.slow_query_ms is not None and elapsed_ms >= self.slow_query_ms
+
+        request = getattr(self._local, 'request', None)
+        if request is not None:
+            request['statements'] += 1
+            request['rows'] += rows
+            request['db_time_ms'] += elapsed_ms
+            if slow:
+                request['slow_statements'] += 1
+
+        with self._lock:
+            entry = self._fingerprints.get(key)
+            if entry is None:
+                if len(self._fingerprints) >= self.max_fingerprints:
+                    key, normalized = 'other', '<other statements>'
+                    entry = self._fingerprints.get(key)
+                if entry is None:
+                    entry = self._fingerprints[key] = {
+                        'sql': normalized,
+                        'calls': 0,
+                        'rows': 0,
+                        'total_ms': 0.0,
+                        'max_ms': 0.0,
+                        'samples': deque(maxlen=self.sample_size)
+                    }
+            entry['calls'] += 1
+            entry['rows'] += rows
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+            entry['samples'].append(elapsed_ms)
+            if slow:
+                self._slow.append({
+                    'fingerprint': key,
+                    'sql': normalized,
+                    'duration_ms': round(elapsed_ms, 3),
+                    'rows': rows,
+                    'request': request['label'] if request else None,
+                    'at': time.time()
+                })
+
+        if slow:
+            slow_query_logger.warning('slow query %.1f ms (%d rows) [%s] %s', elapsed_ms, rows, key, normalized)
+
+    def snapshot(self, top=20, order_by='total_ms'):
+        with self._lock:
+            entries = [(key, dict(entry, samples=sorted(entry['samples']))) for key, entry in self._fingerprints.items()]
+        stats = []
+        for key, entry in entries:
+            samples = entry.pop('samples')
+            entry['fingerprint'] = key
+            entry['avg_ms'] = entry['total_ms'] / entry['calls']
+            entry['p50_ms'] = _percentile(samples, 0.50)
+            entry['p95_ms'] = _percentile(samples, 0.95)
+            entry['p99_ms'] = _percentile(samples, 0.99)
+            stats.append(entry)
+        stats.sort(key=lambda entry: entry[order_by], reverse=True)
+        return stats[:top] if top else stats
+
+    def slow_queries(self, limit=50):
+        with self._lock:
+            slow = list(self._slow)
+        return slow[-limit:][::-1]
+
+    def reset(self):
+        with self._lock:
+            self._fingerprints.clear()
+            self._slow.clear()
+
+
+class InstrumentedCursor:
+    """DB-API cursor wrapper that times each statement, including its fetches."""
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+        self._sql = None
+        self._elapsed = 0.0
+        self._rows = 0
+        self._fetched = False
+
+    def finish(self):
+        """Record the current statement; called before commit and on errors."""
+        if self._sql is None:
+            return
+        rows = self._rows
+        if not self._fetched:
+            rowcount = getattr(self._cursor, 'rowcount', -1)
+            rows = rowcount if rowcount and rowcount > 0 else 0
+        self._stats.record(self._sql, self._elapsed, rows)
+        self._sql = None
+
+    def _timed(self, sql, method, *args):
+        self.finish()
+        self._sql, self._elapsed, self._rows, self._fetched = sql, 0.0, 0, False
+        started = time.perf_counter()
+        try:
+            method(sql, *args)
+        finally:
+            self._elapsed += time.perf_counter() - started
+        return self
+
+    def execute(self, sql, *args):
+        return self._timed(sql, self._cursor.execute, *args)
+
+    def executemany(self, sql, *args):
+        return self._timed(sql, self._cursor.executemany, *args)
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._elapsed += time.perf_counter() - started
+            self._fetched = True
+
+    def fetchone(self):
+        row = self._fetch(self._cursor.fetchone)
+        if row is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._fetch(self._cursor.fetchmany, *args)
+        self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(self._cursor.fetchall)
+        self._rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def close(self):
+        self.finish()
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
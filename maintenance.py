@@ -0,0 +1,42 @@
+"""Database maintenance commands.
+
+    python maintenance.py migrate
+    python maintenance.py rebuild-cluster-stats
+    python maintenance.py rebuild-search-index
+    python maintenance.py rebuild-counters
+"""
+import argparse
+
+from database import init_db, rebuild_cluster_stats, rebuild_counters, rebuild_search_index
+
+def migrate():
+    applied = init_db()
+    print(f"Applied migrations: {applied}" if applied else "Schema is up to date")
+
+def cluster_stats():
+    rebuild_cluster_stats()
+    print("Rebuilt cluster_stats and cluster_activity")
+
+def search_index():
+    rebuild_search_index()
+    print("Rebuilt search index")
+
+def counters():
+    rebuild_counters()
+    print("Rebuilt post_reaction_counts and chat_sessions")
+
+COMMANDS = {
+    'migrate': migrate,
+    'rebuild-cluster-stats': cluster_stats,
+    'rebuild-search-index': search_index,
+    'rebuild-counters': counters,
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Database maintenance commands.')
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    args = parser.parse_args(argv)
+    COMMANDS[args.command]()
+
+if __name__ == '__main__':
+    main()
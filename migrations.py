@@ -0,0 +1,659 @@
+"""Ordered, versioned schema migrations for database.py.
+
+Each migration runs once, in its own transaction, and is recorded in
+schema_version. Steps are SQL strings or callables taking a cursor; every
+migration has a SQL Server ('mssql') and a SQLite ('sqlite') variant.
+"""
+
+_MSSQL_TABLES = {
+    'users': '''
+        CREATE TABLE users (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            first_name NVARCHAR(50) NOT NULL,
+            last_name NVARCHAR(50) NOT NULL,
+            email NVARCHAR(100) UNIQUE NOT NULL,
+            password NVARCHAR(100) NOT NULL,
+            gender NVARCHAR(10) CHECK(gender IN ('male', 'female')) DEFAULT 'male',
+            profile_picture NVARCHAR(255) DEFAULT 'default.png',
+            created_at DATETIME2 DEFAULT GETDATE()
+        )
+    ''',
+    'posts': '''
+        CREATE TABLE posts (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            content NVARCHAR(MAX) NOT NULL,
+            author NVARCHAR(100) NOT NULL,
+            user_id INT NOT NULL,
+            post_type NVARCHAR(20) CHECK(post_type IN ('inquiry', 'lost_cat', 'advice', 'story', 'help', 'other')) DEFAULT 'other',
+            post_image NVARCHAR(255),
+            cluster NVARCHAR(50) DEFAULT 'general',
+            created_at DATETIME2 DEFAULT GETDATE()
+        )
+    ''',
+    'comments': '''
+        CREATE TABLE comments (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            text NVARCHAR(MAX) NOT NULL,
+            author NVARCHAR(100) NOT NULL,
+            user_id INT NOT NULL,
+            post_id INT NOT NULL,
+            created_at DATETIME2 DEFAULT GETDATE()
+        )
+    ''',
+    'reactions': '''
+        CREATE TABLE reactions (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            user_id INT NOT NULL,
+            post_id INT NOT NULL,
+            reaction_type NVARCHAR(10) CHECK(reaction_type IN ('like', 'love', 'haha', 'wow', 'sad', 'angry')) DEFAULT 'like',
+            created_at DATETIME2 DEFAULT GETDATE(),
+            UNIQUE(user_id, post_id)
+        )
+    ''',
+    'search_history': '''
+        CREATE TABLE search_history (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            user_id INT,
+            search_uuid NVARCHAR(36) NOT NULL,
+            location NVARCHAR(255) NOT NULL,
+            search_date DATETIME2 DEFAULT GETDATE(),
+            clinics_found INT DEFAULT 0
+        )
+    ''',
+    'veterinarians': '''
+        CREATE TABLE veterinarians (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            search_uuid NVARCHAR(36) NOT NULL,
+            name NVARCHAR(255) NOT NULL,
+            phone NVARCHAR(50),
+            address NVARCHAR(MAX),
+            website NVARCHAR(500),
+            rating REAL,
+            reviews INT,
+            latitude REAL,
+            longitude REAL,
+            hours NVARCHAR(MAX),
+            saved_at DATETIME2 DEFAULT GETDATE()
+        )
+    ''',
+    'chat_history': '''
+        CREATE TABLE chat_history (
+            id INT IDENTITY(1,1) PRIMARY KEY,
+            user_id INT NOT NULL,
+            message NVARCHAR(MAX) NOT NULL,
+            response NVARCHAR(MAX) NOT NULL,
+            is_user_message BIT NOT NULL,
+            session_id NVARCHAR(100) NOT NULL,
+            created_at DATETIME2 DEFAULT GETDATE()
+        )
+    ''',
+}
+
+_MSSQL_FOREIGN_KEYS = [
+    ('FK_posts_user_id', 'posts', 'user_id', 'users(id)'),
+    ('FK_comments_user_id', 'comments', 'user_id', 'users(id)'),
+    ('FK_comments_post_id', 'comments', 'post_id', 'posts(id)'),
+    ('FK_reactions_user_id', 'reactions', 'user_id', 'users(id)'),
+    ('FK_reactions_post_id', 'reactions', 'post_id', 'posts(id)'),
+    ('FK_search_history_user_id', 'search_history', 'user_id', 'users(id)'),
+    ('FK_chat_history_user_id', 'chat_history', 'user_id', 'users(id)'),
+]
+
+_SQLITE_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        first_name TEXT NOT NULL,
+        last_name TEXT NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        gender TEXT CHECK(gender IN ('male', 'female')) DEFAULT 'male',
+        profile_picture TEXT DEFAULT 'default.png',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS posts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        content TEXT NOT NULL,
+        author TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        post_type TEXT CHECK(post_type IN ('inquiry', 'lost_cat', 'advice', 'story', 'help', 'other')) DEFAULT 'other',
+        post_image TEXT,
+        cluster TEXT DEFAULT 'general',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS comments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        text TEXT NOT NULL,
+        author TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        post_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        FOREIGN KEY (post_id) REFERENCES posts (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS reactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        post_id INTEGER NOT NULL,
+        reaction_type TEXT CHECK(reaction_type IN ('like', 'love', 'haha', 'wow', 'sad', 'angry')) DEFAULT 'like',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user_id, post_id),
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        FOREIGN KEY (post_id) REFERENCES posts (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS search_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        search_uuid TEXT NOT NULL,
+        location TEXT NOT NULL,
+        search_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        clinics_found INTEGER DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS veterinarians (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        search_uuid TEXT NOT NULL,
+        name TEXT NOT NULL,
+        phone TEXT,
+        address TEXT,
+        website TEXT,
+        rating REAL,
+        reviews INTEGER,
+        latitude REAL,
+        longitude REAL,
+        hours TEXT,
+        saved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS chat_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        message TEXT NOT NULL,
+        response TEXT NOT NULL,
+        is_user_message BOOLEAN NOT NULL,
+        session_id TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''',
+]
+
+# Indexes created by init_db() before migrations existed; kept so old and new
+# databases converge on the same schema.
+_LEGACY_INDEXES = [
+    ('IX_users_email', 'users', 'email'),
+    ('IX_posts_user_id', 'posts', 'user_id'),
+    ('IX_posts_cluster', 'posts', 'cluster'),
+    ('IX_comments_post_id', 'comments', 'post_id'),
+    ('IX_reactions_post_id', 'reactions', 'post_id'),
+    ('IX_search_history_user_id', 'search_history', 'user_id'),
+    ('IX_chat_history_user_id', 'chat_history', 'user_id'),
+]
+
+# (name, table, key columns, included columns) matched to the queries in
+# database.py. SQLite has no INCLUDE, so it gets the key columns only. Large
+# NVARCHAR(MAX) bodies are left out; the bounded page sizes keep those lookups cheap.
+_HOT_PATH_INDEXES = [
+    # Feed pages: ORDER BY created_at DESC, id DESC, optionally per cluster
+    ('IX_posts_created_at_id', 'posts', 'created_at DESC, id DESC',
+     'author, user_id, post_type, post_image, cluster'),
+    ('IX_posts_cluster_created_at_id', 'posts', 'cluster, created_at DESC, id DESC',
+     'author, user_id, post_type, post_image'),
+    # Feed comments and comment counts: WHERE post_id IN (...) ORDER BY created_at
+    ('IX_comments_post_id_created_at', 'comments', 'post_id, created_at, id',
+     'author, user_id'),
+    # get_chat_history with and without a session, and session listing
+    ('IX_chat_history_user_session_created', 'chat_history', 'user_id, session_id, created_at',
+     'is_user_message'),
+    ('IX_chat_history_user_created', 'chat_history', 'user_id, created_at DESC',
+     'session_id, is_user_message'),
+    # get_search_history and get_search_results
+    ('IX_search_history_user_date', 'search_history', 'user_id, search_date DESC',
+     'search_uuid, location, clinics_found'),
+    ('IX_search_history_search_uuid', 'search_history', 'search_uuid',
+     'location, search_date, clinics_found'),
+    ('IX_veterinarians_search_uuid_rating', 'veterinarians', 'search_uuid, rating DESC',
+     'name, phone, website, reviews, latitude, longitude'),
+]
+
+# Single-column indexes that are now left-prefixes of a composite index above.
+_SUPERSEDED_INDEXES = [
+    ('IX_posts_cluster', 'posts'),
+    ('IX_comments_post_id', 'comments'),
+    ('IX_search_history_user_id', 'search_history'),
+    ('IX_chat_history_user_id', 'chat_history'),
+]
+
+
+def _mssql_create_table(name):
+    return f'''
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='{name}' AND xtype='U')
+        {_MSSQL_TABLES[name]}
+    '''
+
+def _mssql_add_foreign_key(name, table, column, reference):
+    # WITH NOCHECK: rows written before the constraint existed are not re-validated.
+    return f'''
+        IF NOT EXISTS (SELECT * FROM sys.foreign_keys WHERE name = '{name}')
+        ALTER TABLE {table} WITH NOCHECK
+        ADD CONSTRAINT {name} FOREIGN KEY ({column}) REFERENCES {reference}
+    '''
+
+def _mssql_create_index(name, table, columns, include=None):
+    include_clause = f' INCLUDE ({include})' if include else ''
+    return f'''
+        IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = '{name}' AND object_id = OBJECT_ID('{table}'))
+        CREATE INDEX {name} ON {table}({columns}){include_clause}
+    '''
+
+def _mssql_replace_index(name, table, columns, include=None):
+    # Rebuilds an index of the same name that an older init_db() created without INCLUDE.
+    include_clause = f' INCLUDE ({include})' if include else ''
+    return f'''
+        IF EXISTS (SELECT * FROM sys.indexes WHERE name = '{name}' AND object_id = OBJECT_ID('{table}'))
+            CREATE INDEX {name} ON {table}({columns}){include_clause} WITH (DROP_EXISTING = ON)
+        ELSE
+            CREATE INDEX {name} ON {table}({columns}){include_clause}
+    '''
+
+def _mssql_drop_index(name, table):
+    return f'''
+        IF EXISTS (SELECT * FROM sys.indexes WHERE name = '{name}' AND object_id = OBJECT_ID('{table}'))
+        DROP INDEX {name} ON {table}
+    '''
+
+def _sqlite_create_index(name, table, columns, include=None):
+    return f'CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})'
+
+def _sqlite_drop_index(name, table):
+    return f'DROP INDEX IF EXISTS {name}'
+
+def _seed_demo_user(cursor, backend):
+    from database import hash_password
+    cursor.execute("SELECT id FROM users WHERE email = 'demo@example.com'")
+    if not cursor.fetchone():
+        cursor.execute(
+            backend.insert_sql('users', ('first_name', 'last_name', 'email', 'password', 'gender', 'profile_picture')),
+            ('Demo', 'User', 'demo@example.com', hash_password('password123'), 'male', 'male.png')
+        )
+        cursor.fetchall()
+
+
+_CHAT_SESSIONS_BACKFILL = '''
+    INSERT INTO chat_sessions (user_id, session_id, last_activity, last_message, message_count)
+    SELECT user_id, session_id, created_at, message, message_count
+    FROM (
+        SELECT user_id, session_id, created_at, message,
+               COUNT(*) OVER (PARTITION BY user_id, session_id) AS message_count,
+               ROW_NUMBER() OVER (PARTITION BY user_id, session_id ORDER BY created_at DESC, id DESC) AS position
+        FROM chat_history
+    ) latest
+    WHERE position = 1
+'''
+
+# Turns used to be stored twice (is_user_message 1 and 0) with identical
+# message and response; keep one row per turn.
+_COMPACT_CHAT_TURNS = [
+    '''
+    DELETE FROM chat_history
+    WHERE is_user_message = 0 AND EXISTS (
+        SELECT 1 FROM chat_history u
+        WHERE u.is_user_message = 1
+          AND u.user_id = chat_history.user_id
+          AND u.session_id = chat_history.session_id
+          AND u.message = chat_history.message
+          AND u.response = chat_history.response
+    )
+    ''',
+    'UPDATE chat_history SET is_user_message = 1 WHERE is_user_message = 0',
+    'DELETE FROM chat_sessions',
+    _CHAT_SESSIONS_BACKFILL,
+]
+
+def _build_search_index(cursor, backend):
+    from database import build_search_index
+    build_search_index(cursor)
+
+_CLUSTER_STATS_REBUILD = '''
+    INSERT INTO cluster_stats (cluster, post_count, comment_count, last_post_at)
+    SELECT p.cluster, COUNT(*), COALESCE(SUM(c.comment_count), 0), MAX(p.created_at)
+    FROM posts p
+    LEFT JOIN (
+        SELECT post_id, COUNT(*) AS comment_count FROM comments GROUP BY post_id
+    ) c ON c.post_id = p.id
+    WHERE p.cluster IS NOT NULL
+    GROUP BY p.cluster
+'''
+
+_CLUSTER_ACTIVITY_REBUILD = '''
+    INSERT INTO cluster_activity (cluster, activity_date, post_count, comment_count)
+    SELECT cluster, activity_date, SUM(post_count), SUM(comment_count)
+    FROM (
+        SELECT cluster, {post_date} AS activity_date, 1 AS post_count, 0 AS comment_count
+        FROM posts
+        WHERE cluster IS NOT NULL
+        UNION ALL
+        SELECT p.cluster, {comment_date}, 0, 1
+        FROM comments c
+        JOIN posts p ON p.id = c.post_id
+        WHERE p.cluster IS NOT NULL
+    ) activity
+    GROUP BY cluster, activity_date
+'''
+
+# Also run by database.rebuild_cluster_stats() to repair drift
+CLUSTER_STATS_REBUILD = {
+    'mssql': [
+        'DELETE FROM cluster_stats',
+        'DELETE FROM cluster_activity',
+        _CLUSTER_STATS_REBUILD,
+        _CLUSTER_ACTIVITY_REBUILD.format(post_date='CAST(created_at AS DATE)', comment_date='CAST(c.created_at AS DATE)'),
+    ],
+    'sqlite': [
+        'DELETE FROM cluster_stats',
+        'DELETE FROM cluster_activity',
+        _CLUSTER_STATS_REBUILD,
+        _CLUSTER_ACTIVITY_REBUILD.format(post_date='date(created_at)', comment_date='date(c.created_at)'),
+    ],
+}
+
+# Run by database.rebuild_counters() after loads that bypass the incremental
+# counters, e.g. datagen.py
+COUNTERS_REBUILD = [
+    'DELETE FROM post_reaction_counts',
+    '''
+    INSERT INTO post_reaction_counts (post_id, reaction_type, reaction_count)
+    SELECT post_id, reaction_type, COUNT(*)
+    FROM reactions
+    GROUP BY post_id, reaction_type
+    ''',
+    'DELETE FROM chat_sessions',
+    _CHAT_SESSIONS_BACKFILL,
+]
+
+# Retention scans walk these oldest-first, one bounded batch at a time.
+_RETENTION_INDEXES = [
+    ('IX_chat_history_created_at', 'chat_history', 'created_at, id'),
+    ('IX_veterinarians_saved_at', 'veterinarians', 'saved_at, id'),
+]
+
+MIGRATIONS = [
+    (1, 'baseline schema', {
+        'mssql': [_mssql_create_table(name) for name in _MSSQL_TABLES]
+                 + [_mssql_add_foreign_key(*fk) for fk in _MSSQL_FOREIGN_KEYS]
+                 + [_mssql_create_index(*index) for index in _LEGACY_INDEXES]
+                 + [_seed_demo_user],
+        'sqlite': _SQLITE_TABLES
+                  + [_sqlite_create_index(*index) for index in _LEGACY_INDEXES]
+                  + [_seed_demo_user],
+    }),
+    (2, 'post_reaction_counts', {
+        'mssql': ['''
+            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='post_reaction_counts' AND xtype='U')
+            BEGIN
+                CREATE TABLE post_reaction_counts (
+                    post_id INT NOT NULL,
+                    reaction_type NVARCHAR(10) NOT NULL,
+                    reaction_count INT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (post_id, reaction_type)
+                );
+
+                INSERT INTO post_reaction_counts (post_id, reaction_type, reaction_count)
+                SELECT post_id, reaction_type, COUNT(*)
+                FROM reactions
+                GROUP BY post_id, reaction_type;
+            END
+        '''],
+        'sqlite': [
+            '''
+            CREATE TABLE IF NOT EXISTS post_reaction_counts (
+                post_id INTEGER NOT NULL,
+                reaction_type TEXT NOT NULL,
+                reaction_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (post_id, reaction_type)
+            ) WITHOUT ROWID
+            ''',
+            # OR IGNORE keeps counters already maintained by toggle_reaction()
+            '''
+            INSERT OR IGNORE INTO post_reaction_counts (post_id, reaction_type, reaction_count)
+            SELECT post_id, reaction_type, COUNT(*)
+            FROM reactions
+            GROUP BY post_id, reaction_type
+            ''',
+        ],
+    }),
+    (3, 'hot-path covering indexes', {
+        'mssql': [_mssql_replace_index(*index) for index in _HOT_PATH_INDEXES]
+                 + [_mssql_drop_index(*index) for index in _SUPERSEDED_INDEXES],
+        'sqlite': [_sqlite_create_index(*index) for index in _HOT_PATH_INDEXES]
+                  + [_sqlite_drop_index(*index) for index in _SUPERSEDED_INDEXES]
+                  + ['ANALYZE'],
+    }),
+    (4, 'chat_sessions summaries', {
+        'mssql': [
+            '''
+            CREATE TABLE chat_sessions (
+                user_id INT NOT NULL,
+                session_id NVARCHAR(100) NOT NULL,
+                last_activity DATETIME2 NOT NULL,
+                last_message NVARCHAR(MAX),
+                message_count INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, session_id)
+            )
+            ''',
+            'CREATE INDEX IX_chat_sessions_user_activity ON chat_sessions(user_id, last_activity DESC)',
+            _CHAT_SESSIONS_BACKFILL,
+        ],
+        'sqlite': [
+            '''
+            CREATE TABLE chat_sessions (
+                user_id INTEGER NOT NULL,
+                session_id TEXT NOT NULL,
+                last_activity TIMESTAMP NOT NULL,
+                last_message TEXT,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, session_id)
+            ) WITHOUT ROWID
+            ''',
+            'CREATE INDEX IX_chat_sessions_user_activity ON chat_sessions(user_id, last_activity DESC)',
+            _CHAT_SESSIONS_BACKFILL,
+        ],
+    }),
+    (5, 'one chat_history row per turn', {
+        'mssql': _COMPACT_CHAT_TURNS,
+        'sqlite': _COMPACT_CHAT_TURNS,
+    }),
+    (6, 'retention archive', {
+        'mssql': [
+            '''
+            CREATE TABLE retention_archive (
+                id INT IDENTITY(1,1) PRIMARY KEY,
+                source_table NVARCHAR(100) NOT NULL,
+                partition_key CHAR(7) NOT NULL,
+                first_id INT NOT NULL,
+                last_id INT NOT NULL,
+                row_count INT NOT NULL,
+                oldest DATETIME2 NOT NULL,
+                newest DATETIME2 NOT NULL,
+                payload VARBINARY(MAX) NOT NULL,
+                archived_at DATETIME2 DEFAULT GETDATE()
+            )
+            ''',
+            'CREATE INDEX IX_retention_archive_partition ON retention_archive(source_table, partition_key)',
+        ] + [_mssql_create_index(*index) for index in _RETENTION_INDEXES],
+        'sqlite': [
+            '''
+            CREATE TABLE retention_archive (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source_table TEXT NOT NULL,
+                partition_key TEXT NOT NULL,
+                first_id INTEGER NOT NULL,
+                last_id INTEGER NOT NULL,
+                row_count INTEGER NOT NULL,
+                oldest TIMESTAMP NOT NULL,
+                newest TIMESTAMP NOT NULL,
+                payload BLOB NOT NULL,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            'CREATE INDEX IX_retention_archive_partition ON retention_archive(source_table, partition_key)',
+        ] + [_sqlite_create_index(*index) for index in _RETENTION_INDEXES],
+    }),
+    (7, 'full-text search index', {
+        'mssql': [
+            '''
+            CREATE TABLE search_terms (
+                term NVARCHAR(64) NOT NULL PRIMARY KEY,
+                doc_count INT NOT NULL DEFAULT 0
+            )
+            ''',
+            '''
+            CREATE TABLE search_postings (
+                term NVARCHAR(64) NOT NULL,
+                post_id INT NOT NULL,
+                weight REAL NOT NULL,
+                PRIMARY KEY (term, post_id)
+            )
+            ''',
+            'CREATE INDEX IX_search_postings_term_weight ON search_postings(term, weight DESC, post_id DESC)',
+            _build_search_index,
+        ],
+        'sqlite': [
+            '''
+            CREATE TABLE search_terms (
+                term TEXT NOT NULL PRIMARY KEY,
+                doc_count INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+            ''',
+            '''
+            CREATE TABLE search_postings (
+                term TEXT NOT NULL,
+                post_id INTEGER NOT NULL,
+                weight REAL NOT NULL,
+                PRIMARY KEY (term, post_id)
+            ) WITHOUT ROWID
+            ''',
+            'CREATE INDEX IX_search_postings_term_weight ON search_postings(term, weight DESC, post_id DESC)',
+            _build_search_index,
+        ],
+    }),
+    (8, 'cluster statistics', {
+        'mssql': [
+            '''
+            CREATE TABLE cluster_stats (
+                cluster NVARCHAR(50) NOT NULL PRIMARY KEY,
+                post_count INT NOT NULL DEFAULT 0,
+                comment_count INT NOT NULL DEFAULT 0,
+                last_post_at DATETIME2 NULL
+            )
+            ''',
+            '''
+            CREATE TABLE cluster_activity (
+                activity_date DATE NOT NULL,
+                cluster NVARCHAR(50) NOT NULL,
+                post_count INT NOT NULL DEFAULT 0,
+                comment_count INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (activity_date, cluster)
+            )
+            ''',
+        ] + CLUSTER_STATS_REBUILD['mssql'],
+        'sqlite': [
+            '''
+            CREATE TABLE cluster_stats (
+                cluster TEXT NOT NULL PRIMARY KEY,
+                post_count INTEGER NOT NULL DEFAULT 0,
+                comment_count INTEGER NOT NULL DEFAULT 0,
+                last_post_at TIMESTAMP
+            ) WITHOUT ROWID
+            ''',
+            '''
+            CREATE TABLE cluster_activity (
+                activity_date DATE NOT NULL,
+                cluster TEXT NOT NULL,
+                post_count INTEGER NOT NULL DEFAULT 0,
+                comment_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (activity_date, cluster)
+            ) WITHOUT ROWID
+            ''',
+        ] + CLUSTER_STATS_REBUILD['sqlite'],
+    }),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+_SCHEMA_VERSION_DDL = {
+    'mssql': '''
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='schema_version' AND xtype='U')
+        CREATE TABLE schema_version (
+            version INT PRIMARY KEY,
+            name NVARCHAR(200) NOT NULL,
+            applied_at DATETIME2 DEFAULT GETDATE()
+        )
+    ''',
+    'sqlite': '''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''',
+}
+
+
+def get_schema_version(get_cursor, backend):
+    """Current schema version, or 0 for a database that predates migrations."""
+    try:
+        with get_cursor() as cursor:
+            cursor.execute('SELECT MAX(version) FROM schema_version')
+            return cursor.fetchone()[0] or 0
+    except backend.Error:
+        return 0
+
+def _lock(cursor, backend):
+    # Serialize concurrent workers starting against the same database.
+    if backend.name == 'sqlite':
+        cursor.execute('BEGIN IMMEDIATE')
+    else:
+        cursor.execute(
+            "EXEC sp_getapplock @Resource = 'schema_migrations', @LockMode = 'Exclusive', "
+            "@LockOwner = 'Transaction', @LockTimeout = 60000"
+        )
+
+def migrate(get_cursor, backend, target=None):
+    """Apply pending migrations up to ``target``; returns the versions applied."""
+    target = LATEST_VERSION if target is None else target
+    if get_schema_version(get_cursor, backend) >= target:
+        return []
+
+    with get_cursor() as cursor:
+        cursor.execute(_SCHEMA_VERSION_DDL[backend.name])
+
+    applied = []
+    for version, name, steps in MIGRATIONS:
+        if version > target:
+            break
+        with get_cursor() as cursor:
+            _lock(cursor, backend)
+            cursor.execute('SELECT MAX(version) FROM schema_version')
+            if (cursor.fetchone()[0] or 0) >= version:
+                continue
+            for step in steps[backend.name]:
+                if callable(step):
+                    step(cursor, backend)
+                else:
+                    cursor.execute(step)
+            cursor.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+        applied.append(version)
+    return applied
@@ -0,0 +1,210 @@
+import os
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of DB-API connections.
+
+    Connections are created lazily up to ``max_size``. Idle connections that
+    are older than ``max_age`` seconds are recycled, and connections that sat
+    idle longer than ``ping_after`` seconds are health-checked on checkout.
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, max_age=1800, timeout=30,
+                 ping_after=30, ping_sql='SELECT 1'):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError("Invalid pool size")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_age = max_age
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.ping_sql = ping_sql
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._in_use = {}
+        self._size = 0
+        self._waiters = 0
+        self._pid = os.getpid()
+        self._closed = False
+
+        self._stats = {
+            'checkouts': 0,
+            'connections_created': 0,
+            'connections_closed': 0,
+            'health_check_failures': 0,
+            'recycled': 0,
+            'timeouts': 0,
+            'max_waiters': 0,
+            'checkout_time_total': 0.0,
+            'checkout_time_max': 0.0,
+        }
+
+    def _open(self):
+        conn = self._connect()
+        now = time.monotonic()
+        with self._cond:
+            self._stats['connections_created'] += 1
+        return conn, now
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats['connections_closed'] += 1
+            self._cond.notify()
+
+    def _healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.ping_sql)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _check_fork(self):
+        # gunicorn forks workers after import; never share sockets across processes.
+        if self._pid != os.getpid():
+            self._idle.clear()
+            self._in_use.clear()
+            self._size = 0
+            self._pid = os.getpid()
+
+    def fill(self):
+        """Open connections until ``min_size`` are available."""
+        while True:
+            with self._cond:
+                self._check_fork()
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn, created_at = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append((conn, created_at, time.monotonic()))
+                self._cond.notify()
+
+    def acquire(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            candidate = None
+            with self._cond:
+                self._check_fork()
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                    self._waiters += 1
+                    self._stats['max_waiters'] = max(self._stats['max_waiters'], self._waiters)
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiters -= 1
+                if self._idle:
+                    candidate = self._idle.pop()
+                else:
+                    self._size += 1
+
+            if candidate is None:
+                try:
+                    conn, created_at = self._open()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            else:
+                conn, created_at, last_used = candidate
+                now = time.monotonic()
+                if self.max_age and now - created_at > self.max_age:
+                    with self._cond:
+                        self._stats['recycled'] += 1
+                    self._discard(conn)
+                    continue
+                if self.ping_after is not None and now - last_used > self.ping_after and not self._healthy(conn):
+                    with self._cond:
+                        self._stats['health_check_failures'] += 1
+                    self._discard(conn)
+                    continue
+
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self._in_use[id(conn)] = created_at
+                self._stats['checkouts'] += 1
+                self._stats['checkout_time_total'] += elapsed
+                self._stats['checkout_time_max'] = max(self._stats['checkout_time_max'], elapsed)
+            return conn
+
+    def release(self, conn, discard=False):
+        with self._cond:
+            created_at = self._in_use.pop(id(conn), None)
+        if created_at is None:
+            # Checked out before a fork or after close(); not ours to keep.
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+
+        if not discard and self.max_age and time.monotonic() - created_at > self.max_age:
+            with self._cond:
+                self._stats['recycled'] += 1
+            discard = True
+
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        if discard or self._closed:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'waiters': self._waiters,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+            })
+        checkouts = stats['checkouts']
+        stats['checkout_time_avg'] = stats['checkout_time_total'] / checkouts if checkouts else 0.0
+        return stats
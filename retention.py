@@ -0,0 +1,280 @@
+"""Retention and archival for tables that only grow.
+
+Rows older than a policy's ``max_age_days`` are moved out of the live table
+``batch_size`` rows at a time, oldest first, each batch in its own
+transaction. Archived rows are grouped by month (the partition key) and
+written either to the retention_archive table as zlib-compressed NDJSON, or
+to gzip NDJSON files laid out as <archive_dir>/<table>/<YYYY-MM>.ndjson.gz.
+
+    python retention.py                  # dry run: what would be archived
+    python retention.py --apply          # archive into retention_archive
+    python retention.py --apply --target file --max-age chat_history=90
+"""
+import argparse
+import gzip
+import json
+import os
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+
+from database import get_backend, get_db_cursor
+
+ARCHIVE_TARGET = 'table'  # 'table' or 'file'
+ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive')
+
+# One DELETE ... IN (...) per batch, so stay under SQL Server's 2100-parameter cap
+RETENTION_BATCH_SIZE = 500
+RETENTION_MAX_BATCH_SIZE = 2000
+
+def _release_chat_sessions(cursor, rows):
+    # Keep chat_sessions in step with what is left in chat_history.
+    counts = Counter((row['user_id'], row['session_id']) for row in rows)
+    for (user_id, session_id), count in sorted(counts.items()):
+        cursor.execute('''
+            UPDATE chat_sessions SET message_count = message_count - ?
+            WHERE user_id = ? AND session_id = ?
+        ''', (count, user_id, session_id))
+        cursor.execute('''
+            DELETE FROM chat_sessions
+            WHERE user_id = ? AND session_id = ? AND message_count <= 0
+        ''', (user_id, session_id))
+
+RETENTION_POLICIES = {
+    'chat_history': {
+        'date_column': 'created_at',
+        'max_age_days': 365,
+        'columns': ('id', 'user_id', 'message', 'response', 'is_user_message', 'session_id', 'created_at'),
+        'size_columns': ('message', 'response', 'session_id'),
+        'on_archive': _release_chat_sessions,
+    },
+    'veterinarians': {
+        'date_column': 'saved_at',
+        'max_age_days': 180,
+        'columns': ('id', 'search_uuid', 'name', 'phone', 'address', 'website', 'rating', 'reviews',
+                    'latitude', 'longitude', 'hours', 'saved_at'),
+        'size_columns': ('search_uuid', 'name', 'phone', 'address', 'website', 'hours'),
+    },
+}
+
+def _as_datetime(value):
+    # SQLite hands back aggregates and expressions as text.
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+def _cutoff(cursor, policy, as_of=None):
+    # Use the database clock unless told otherwise; SQLite's CURRENT_TIMESTAMP is
+    # UTC, SQL Server's is local.
+    if as_of is None:
+        cursor.execute('SELECT CURRENT_TIMESTAMP')
+        as_of = _as_datetime(cursor.fetchone()[0])
+    return as_of - timedelta(days=policy['max_age_days'])
+
+def _selected_policies(tables=None, policies=None):
+    policies = RETENTION_POLICIES if policies is None else policies
+    names = list(policies) if tables is None else tables
+    for name in names:
+        if name not in policies:
+            raise ValueError(f"No retention policy for table: {name}")
+        yield name, policies[name]
+
+def _encode_rows(rows):
+    return '\n'.join(json.dumps(row, default=str, ensure_ascii=False) for row in rows).encode('utf-8')
+
+def _partition(rows, date_column):
+    partitions = {}
+    for row in rows:
+        partition_key = _as_datetime(row[date_column]).strftime('%Y-%m')
+        partitions.setdefault(partition_key, []).append(row)
+    return sorted(partitions.items())
+
+def _archive_to_table(cursor, table, partition_key, rows, date_column):
+    payload = zlib.compress(_encode_rows(rows))
+    ids = [row['id'] for row in rows]
+    dates = [_as_datetime(row[date_column]) for row in rows]
+    cursor.execute('''
+        INSERT INTO retention_archive
+            (source_table, partition_key, first_id, last_id, row_count, oldest, newest, payload)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (table, partition_key, min(ids), max(ids), len(rows), min(dates), max(dates), payload))
+    return len(payload)
+
+def _archive_to_file(archive_dir, table, partition_key, rows):
+    # Written and synced before the DELETE commits: a failed batch can leave
+    # duplicates in the file, never a gap. Readers should de-duplicate on id.
+    directory = os.path.join(archive_dir, table)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{partition_key}.ndjson.gz')
+    with open(path, 'ab') as raw:
+        start = raw.tell()
+        with gzip.GzipFile(fileobj=raw, mode='ab') as archive:
+            archive.write(_encode_rows(rows) + b'\n')
+        raw.flush()
+        os.fsync(raw.fileno())
+        return raw.tell() - start
+
+def archive_table(table, policy, target=ARCHIVE_TARGET, batch_size=RETENTION_BATCH_SIZE,
+                  max_batches=None, archive_dir=ARCHIVE_DIR, as_of=None):
+    """Move rows past ``policy``'s age, counted back from ``as_of`` (default: the
+    database clock), out of ``table``; returns a summary dict."""
+    if target not in ('table', 'file'):
+        raise ValueError(f"Unknown archive target: {target}")
+    batch_size = max(1, min(batch_size, RETENTION_MAX_BATCH_SIZE))
+    backend = get_backend()
+    columns = policy['columns']
+    date_column = policy['date_column']
+
+    with get_db_cursor() as cursor:
+        cutoff = _cutoff(cursor, policy, as_of)
+
+    archived = batches = compressed_bytes = 0
+    partitions = set()
+    while max_batches is None or batches < max_batches:
+        with get_db_cursor() as cursor:
+            cursor.execute(f'''
+                SELECT {', '.join(columns)}
+                FROM {table}
+                WHERE {date_column} < ?
+                ORDER BY {date_column}, id
+                {backend.limit_clause}
+            ''', (cutoff, batch_size))
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            if not rows:
+                break
+
+            for partition_key, partition_rows in _partition(rows, date_column):
+                if target == 'file':
+                    compressed_bytes += _archive_to_file(archive_dir, table, partition_key, partition_rows)
+                else:
+                    compressed_bytes += _archive_to_table(cursor, table, partition_key, partition_rows, date_column)
+                partitions.add(partition_key)
+
+            ids = [row['id'] for row in rows]
+            cursor.execute(f"DELETE FROM {table} WHERE id IN ({', '.join('?' * len(ids))})", ids)
+            if policy.get('on_archive'):
+                policy['on_archive'](cursor, rows)
+
+        archived += len(rows)
+        batches += 1
+        if len(rows) < batch_size:
+            break
+
+    return {
+        'table': table,
+        'target': target,
+        'cutoff': cutoff,
+        'archived': archived,
+        'batches': batches,
+        'partitions': sorted(partitions),
+        'compressed_bytes': compressed_bytes
+    }
+
+def retention_report(tables=None, policies=None, batch_size=RETENTION_BATCH_SIZE, as_of=None):
+    """Dry run: how many rows each policy would archive and the bytes they hold.
+
+    ``reclaimable_bytes`` counts column data only, so it understates what the
+    table and its indexes actually give back.
+    """
+    backend = get_backend()
+    report = []
+    for table, policy in _selected_policies(tables, policies):
+        date_column = policy['date_column']
+        size = ' + '.join(f"COALESCE({backend.byte_length_sql(column)}, 0)" for column in policy['size_columns'])
+        with get_db_cursor() as cursor:
+            cutoff = _cutoff(cursor, policy, as_of)
+            cursor.execute(f'''
+                SELECT COUNT(*), MIN({date_column}), MAX({date_column}), SUM({size})
+                FROM {table}
+                WHERE {date_column} < ?
+            ''', (cutoff,))
+            eligible, oldest, newest, reclaimable = cursor.fetchone()
+            cursor.execute(f'SELECT COUNT(*) FROM {table}')
+            total = cursor.fetchone()[0]
+
+        report.append({
+            'table': table,
+            'max_age_days': policy['max_age_days'],
+            'cutoff': cutoff,
+            'total_rows': total,
+            'eligible_rows': eligible,
+            'oldest': _as_datetime(oldest),
+            'newest': _as_datetime(newest),
+            'reclaimable_bytes': reclaimable or 0,
+            'batches': -(-eligible // batch_size)
+        })
+    return report
+
+def apply_retention(tables=None, policies=None, target=ARCHIVE_TARGET, batch_size=RETENTION_BATCH_SIZE,
+                    max_batches=None, archive_dir=ARCHIVE_DIR, as_of=None):
+    return [
+        archive_table(table, policy, target, batch_size, max_batches, archive_dir, as_of)
+        for table, policy in _selected_policies(tables, policies)
+    ]
+
+def iter_archived_rows(table, partition_key=None, target=ARCHIVE_TARGET, archive_dir=ARCHIVE_DIR):
+    """Yield archived rows of ``table`` as dicts, optionally for one YYYY-MM partition."""
+    if target == 'file':
+        directory = os.path.join(archive_dir, table)
+        if not os.path.isdir(directory):
+            return
+        names = sorted(name for name in os.listdir(directory) if name.endswith('.ndjson.gz'))
+        if partition_key:
+            names = [name for name in names if name == f'{partition_key}.ndjson.gz']
+        for name in names:
+            with gzip.open(os.path.join(directory, name), 'rt', encoding='utf-8') as archive:
+                for line in archive:
+                    if line.strip():
+                        yield json.loads(line)
+        return
+
+    with get_db_cursor() as cursor:
+        if partition_key:
+            cursor.execute('''
+                SELECT payload FROM retention_archive
+                WHERE source_table = ? AND partition_key = ?
+                ORDER BY id
+            ''', (table, partition_key))
+        else:
+            cursor.execute('''
+                SELECT payload FROM retention_archive
+                WHERE source_table = ?
+                ORDER BY partition_key, id
+            ''', (table,))
+        payloads = [row[0] for row in cursor.fetchall()]
+    for payload in payloads:
+        for line in zlib.decompress(payload).decode('utf-8').splitlines():
+            yield json.loads(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Archive old chat_history and veterinarians rows.')
+    parser.add_argument('tables', nargs='*', help='tables to process (default: every policy)')
+    parser.add_argument('--apply', action='store_true', help='archive rows instead of reporting')
+    parser.add_argument('--target', choices=('table', 'file'), default=ARCHIVE_TARGET)
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR)
+    parser.add_argument('--batch-size', type=int, default=RETENTION_BATCH_SIZE)
+    parser.add_argument('--max-batches', type=int)
+    parser.add_argument('--max-age', action='append', default=[], metavar='TABLE=DAYS',
+                        help='override a policy age, e.g. chat_history=90')
+    parser.add_argument('--as-of', type=datetime.fromisoformat, metavar='DATETIME',
+                        help='count ages back from this time instead of the database clock, '
+                             'e.g. datagen.DATA_END for generated data')
+    args = parser.parse_args(argv)
+
+    policies = {table: dict(policy) for table, policy in RETENTION_POLICIES.items()}
+    for override in args.max_age:
+        table, _, days = override.partition('=')
+        if table not in policies or not days.isdigit():
+            parser.error(f"Invalid --max-age: {override}")
+        policies[table]['max_age_days'] = int(days)
+
+    tables = args.tables or None
+    if args.apply:
+        result = apply_retention(tables, policies, args.target, args.batch_size, args.max_batches, args.archive_dir,
+                                 args.as_of)
+    else:
+        result = retention_report(tables, policies, args.batch_size, args.as_of)
+    print(json.dumps(result, default=str, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import json
+import os
+import sys
+import threading
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database
+
+
+class FakeKnowledgeBase:
+    def __init__(self):
+        self.ready = threading.Event()
+        self.ready.set()
+        self.warmup = {'state': 'ready'}
+        self.version = 'test'
+
+    def warming_up(self):
+        return False
+
+    def start_warmup(self):
+        pass
+
+    def start_watcher(self):
+        pass
+
+    def stop_watcher(self):
+        pass
+
+    def status(self):
+        return {'version': self.version}
+
+
+class FakeChatbotEngine:
+    """Streams a fixed answer in pieces, as the LLM would."""
+
+    answer = ('Cats ', 'need ', 'water.')
+
+    def stream(self, query):
+        yield from self.answer
+
+    def status(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+class FakeAnswerCache:
+    def start_saver(self):
+        pass
+
+    def stats(self):
+        return {}
+
+
+@pytest.fixture
+def primary(tmp_path):
+    database.configure_database('sqlite', path=str(tmp_path / 'primary.db'))
+    database.init_db()
+    yield tmp_path
+    database.flush_chat_queue()
+
+
+@pytest.fixture
+def lagging_replica(primary):
+    """A replica with the schema that never receives the primary's writes."""
+    replica_path = str(primary / 'replica.db')
+    database.configure_database('sqlite', path=replica_path)
+    database.init_db()
+    database.configure_database('sqlite', path=str(primary / 'primary.db'))
+    database.configure_replica('sqlite', path=replica_path)
+    yield replica_path
+    database.configure_replica(None)
+
+
+@pytest.fixture
+def app(primary, monkeypatch):
+    """The Flask app from the notebook's first cell, with a scripted chatbot."""
+    core = types.ModuleType('core')
+    core.knowledge_base = FakeKnowledgeBase()
+    core.chatbot_engine = FakeChatbotEngine()
+    core.answer_cache = FakeAnswerCache()
+    core.get_chatbot_response = lambda message: ''.join(FakeChatbotEngine.answer)
+    core.KB_WARMUP_WAIT = 0
+    core.LLM_TIMEOUT = 30
+    monkeypatch.setitem(sys.modules, 'core', core)
+    monkeypatch.setitem(sys.modules, 'vet', types.SimpleNamespace(GoogleMapsScraper=None))
+
+    with open(os.path.join(ROOT, 'app.ipynb'), encoding='utf-8') as f:
+        source = ''.join(json.load(f)['cells'][0]['source'])
+    namespace = {'__name__': 'app'}
+    exec(compile(source, 'app.ipynb', 'exec'), namespace)
+    app = namespace['app']
+    app.config['TESTING'] = True
+    return app
@@ -0,0 +1,51 @@
+import threading
+
+import numpy as np
+
+from answer_cache import SemanticAnswerCache
+
+
+def _cache(**options):
+    return SemanticAnswerCache(lambda text: np.ones(4), **options)
+
+
+def test_waiter_computes_its_own_answer_when_the_leader_stalls():
+    cache = _cache(wait_timeout=0.05)
+    answer, source, flight = cache.claim('How often should I feed my cat?', 'v1')
+    assert (answer, source) == (None, None) and flight is not None
+
+    # The leader never finishes, like a stream its client abandoned
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(cache.claim('how often should i feed my cat', 'v1')))
+    waiter.start()
+    waiter.join(2)
+
+    assert not waiter.is_alive()
+    assert result == [(None, None, None)]
+    assert cache.stats()['wait_timeouts'] == 1
+
+
+class _WatchedEvent(threading.Event):
+    def __init__(self):
+        super().__init__()
+        self.waiting = threading.Event()
+
+    def wait(self, timeout=None):
+        self.waiting.set()
+        return super().wait(timeout)
+
+
+def test_waiters_count_as_hits_only_when_they_get_the_shared_answer():
+    cache = _cache(wait_timeout=5)
+    for answer in (None, 'Twice a day.'):
+        _, _, flight = cache.claim('How often should I feed my cat?', 'v1')
+        flight.done = _WatchedEvent()
+        waiter = threading.Thread(target=cache.claim, args=('how often should i feed my cat', 'v1'))
+        waiter.start()
+        flight.done.waiting.wait(2)
+        cache.finish(flight, answer, False)
+        waiter.join()
+
+    stats = cache.stats()
+    assert stats['coalesced'] == 1
+    assert stats['misses'] == 3
@@ -0,0 +1,14 @@
+import database
+
+
+def test_deleted_turns_match_the_listed_count(primary):
+    user_id = database.create_user('Session', 'Counter', 'sessions@example.com', 'password123')
+    for number in range(3):
+        database.queue_chat_turn(user_id, f'question {number}', f'answer {number}', 's1')
+    database.queue_chat_turn(user_id, 'other', 'answer', 's2')
+
+    listed = {entry['session_id']: entry['message_count'] for entry in database.get_chat_sessions(user_id)}
+
+    assert listed == {'s1': 3, 's2': 1}
+    assert database.delete_chat_session(user_id, 's1') == listed['s1']
+    assert [entry['session_id'] for entry in database.get_chat_sessions(user_id)] == ['s2']
@@ -0,0 +1,18 @@
+import database
+
+
+def test_streamed_turn_is_read_back_from_the_primary(app, lagging_replica):
+    user_id = database.create_user('Stream', 'Reader', 'stream@example.com', 'password123')
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+
+    response = client.post('/chatbot/message', json={'message': 'Do cats drink?', 'session_id': 's1', 'stream': True})
+    body = response.get_data(as_text=True)
+    assert '"history_saved": true' in body
+
+    primary_reads = database.get_replica_stats()['primary_reads']
+    history = client.get('/api/chat/history?session_id=s1').get_json()
+
+    assert [entry['response'] for entry in history['messages']] == ['Cats need water.', 'Cats need water.']
+    assert database.get_replica_stats()['primary_reads'] > primary_reads
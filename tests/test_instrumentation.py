@@ -0,0 +1,13 @@
+from instrumentation import _percentile
+
+
+def test_percentiles_are_nearest_rank():
+    samples = [float(value) for value in range(1, 101)]
+
+    assert _percentile(samples, 0.50) == 50.0
+    assert _percentile(samples, 0.95) == 95.0
+    assert _percentile(samples, 0.99) == 99.0
+    assert _percentile(samples, 1.0) == 100.0
+    assert _percentile(samples, 0.0) == 1.0
+    assert _percentile([7.0], 0.99) == 7.0
+    assert _percentile([], 0.95) == 0.0
@@ -0,0 +1,142 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger('write_behind')
+
+
+class WriteBehindQueue:
+    """Bounded queue drained by a background thread in batches.
+
+    ``write(items)`` is called with up to ``batch_size`` items at a time. When
+    the queue is full, ``put()`` waits up to ``put_timeout`` seconds and then
+    writes the item on the caller's thread, so producers slow down instead of
+    losing data. A batch that still fails after ``retries`` attempts is logged
+    with ``describe(batch)``; on the caller's thread the error is raised.
+    """
+
+    def __init__(self, write, max_size=1000, batch_size=100, flush_interval=0.5, put_timeout=1.0,
+                 retries=3, name='write-behind', describe=None):
+        self._write = write
+        self._describe = describe
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.retries = retries
+        self.name = name
+
+        self._queue = queue.Queue(max_size)
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._thread = None
+        self._stopping = False
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'batches': 0,
+            'failed': 0,
+            'sync_writes': 0,
+            'max_depth': 0,
+        }
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._cond:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stopping = False
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def put(self, item):
+        self._ensure_started()
+        with self._cond:
+            self._pending += 1
+            self._stats['enqueued'] += 1
+        try:
+            self._queue.put(item, timeout=self.put_timeout)
+        except queue.Full:
+            with self._cond:
+                self._stats['sync_writes'] += 1
+            error = self._write_batch([item])
+            if error is not None:
+                raise error
+            return
+        with self._cond:
+            self._stats['max_depth'] = max(self._stats['max_depth'], self._queue.qsize())
+
+    def pending(self):
+        with self._cond:
+            return self._pending
+
+    def _write_batch(self, batch):
+        """Write ``batch`` with retries; returns the last error if it was dropped."""
+        error = None
+        for attempt in range(self.retries):
+            try:
+                self._write(batch)
+                error = None
+                break
+            except Exception as e:
+                error = e
+                if attempt + 1 < self.retries:
+                    time.sleep(0.1 * 2 ** attempt)
+                else:
+                    logger.exception(
+                        "%s: dropped %d item(s) after %d attempts: %s",
+                        self.name, len(batch), self.retries,
+                        self._describe(batch) if self._describe else ''
+                    )
+        with self._cond:
+            if error is None:
+                self._stats['written'] += len(batch)
+                self._stats['batches'] += 1
+            else:
+                self._stats['failed'] += len(batch)
+            self._pending -= len(batch)
+            self._cond.notify_all()
+        return error
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._stopping:
+                    return
+                continue
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is written; returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending > 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=10):
+        """Flush and stop the writer thread; meant for shutdown hooks."""
+        flushed = self.flush(timeout)
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return flushed
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['pending'] = self._pending
+        stats['depth'] = self._queue.qsize()
+        stats['max_size'] = self.max_size
+        return stats